@@ -0,0 +1,205 @@
+try:
+    from functools import lru_cache
+except ImportError:
+    from backports.functools_lru_cache import lru_cache
+
+import logging
+import os
+import numpy as np
+from arthur import constants
+
+logger = logging.getLogger(__name__)
+
+
+class GainTable(object):
+    """
+    Complex gains per antenna, optionally per channel, and the antennas
+    which are flagged. Flagged antennas get a gain of zero, so flagging is
+    applied together with the gains.
+    """
+    def __init__(self, gains, flags=None):
+        """
+        args:
+            gains (numpy.array): NUM_ANTS or CHANNELS x NUM_ANTS complex gains
+            flags (numpy.array): NUM_ANTS booleans, True for a flagged
+                                 antenna
+        """
+        if gains.ndim == 1:
+            gains = gains[np.newaxis]
+        self.gains = gains
+        antennas = gains.shape[1]
+        if flags is None:
+            flags = np.zeros(antennas, dtype=bool)
+        self.flags = np.asarray(flags, dtype=bool)
+        self.unity = not self.flags.any() and bool(np.all(gains == 1))
+        self._antenna_gains = None
+        self._baseline_gains = {}
+
+    @property
+    def channels(self):
+        return self.gains.shape[0]
+
+    def antenna_gains(self):
+        """
+        returns:
+            numpy.array: NUM_ANTS gains averaged over the channels, zero for
+                         flagged antennas
+        """
+        if self._antenna_gains is None:
+            gains = self.gains.mean(axis=0).astype(np.complex64)
+            gains[self.flags] = 0
+            self._antenna_gains = gains
+        return self._antenna_gains
+
+    def baseline_gains(self, mean=False):
+        """
+        args:
+            mean (bool): use the channel averaged gains
+
+        returns:
+            numpy.array: CHANNELS x BASELINES factors g[a1] * conj(g[a2]) for
+                         the lower triangle baselines, zero for baselines
+                         with a flagged antenna. 1 x BASELINES if mean.
+        """
+        if mean not in self._baseline_gains:
+            if mean:
+                gains = self.antenna_gains()[np.newaxis]
+            else:
+                gains = np.where(self.flags, 0, self.gains)
+                gains = gains.astype(np.complex64)
+            a1, a2 = np.tril_indices(self.gains.shape[1])
+            self._baseline_gains[mean] = gains[:, a1] * gains[:, a2].conj()
+        return self._baseline_gains[mean]
+
+
+def unity_gains(antennas=constants.NUM_ANTS):
+    """
+    returns:
+        GainTable: no calibration
+    """
+    return GainTable(np.ones(antennas, dtype=np.complex64))
+
+
+def load_gains(path):
+    """
+    Load a gain table, cached until the file is modified.
+
+    args:
+        path (str): a .npy file with NUM_ANTS or CHANNELS x NUM_ANTS complex
+                    gains, a .npz file with 'gains' and optionally 'flags' or
+                    a casacore calibration table
+
+    returns:
+        GainTable
+    """
+    return _load_gains(path, os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _load_gains(path, mtime):
+    logger.info("loading gains from {}".format(path))
+    if path.endswith('.npy'):
+        return GainTable(np.load(path, mmap_mode='r'))
+    if path.endswith('.npz'):
+        with np.load(path) as f:
+            flags = f['flags'] if 'flags' in f else None
+            return GainTable(f['gains'], flags)
+    return _load_casacore_gains(path)
+
+
+def _load_casacore_gains(path, pol=0):
+    """
+    Read the CPARAM solutions of a casacore calibration table, later rows
+    overwrite earlier solutions of the same antenna.
+    """
+    from casacore.tables import table
+    with table(path, ack=False) as t:
+        antennas = t.getcol('ANTENNA1')
+        solutions = t.getcol('CPARAM')[:, :, pol]
+        flagged = t.getcol('FLAG')[:, :, pol]
+    gains = np.ones((solutions.shape[1], constants.NUM_ANTS),
+                    dtype=np.complex64)
+    gains[:, antennas] = np.where(flagged, 0, solutions).T
+    flags = np.zeros(constants.NUM_ANTS, dtype=bool)
+    flags[antennas] = flagged.all(axis=1)
+    return GainTable(gains, flags)
+
+
+def apply_gains(cm, gains):
+    """
+    Calibrate a correlation matrix in place, g[:, None] * cm * g.conj()[None, :]
+    with the channel averaged gains. Does nothing for unity gains.
+
+    args:
+        cm (numpy.array): NUM_ANTS x NUM_ANTS correlation matrix
+        gains (GainTable): the gains, or None
+
+    returns:
+        numpy.array: cm
+    """
+    if gains is None or gains.unity:
+        return cm
+    g = gains.antenna_gains()
+    cm *= g[:, np.newaxis]
+    cm *= g.conj()[np.newaxis, :]
+    return cm
+
+
+def apply_gains_triangle(triangle, gains):
+    """
+    Calibrate the lower triangle of a correlation matrix in place with the
+    channel averaged gains, like apply_gains(). Does nothing for unity gains.
+
+    args:
+        triangle (numpy.array): BASELINES (x POLS) visibilities
+        gains (GainTable): the gains, or None
+
+    returns:
+        numpy.array: triangle
+    """
+    if gains is None or gains.unity:
+        return triangle
+    factors = gains.baseline_gains(mean=True)[0]
+    triangle *= factors.reshape(factors.shape + (1,) * (triangle.ndim - 1))
+    return triangle
+
+
+def calibrated_mean(body, gains):
+    """
+    The calibrated channel mean of a body, every channel is calibrated with
+    its own gains if the table has them.
+
+    args:
+        body (numpy.array): CHANNELS x BASELINES (x POLS) visibilities
+        gains (GainTable): the gains, or None
+
+    returns:
+        numpy.array: BASELINES (x POLS), a new array
+    """
+    if gains is None or gains.unity:
+        return body.mean(axis=0)
+    factors = gains.baseline_gains()
+    factors = factors.reshape(factors.shape + (1,) * (body.ndim - 2))
+    if gains.channels == 1:
+        mean = body.mean(axis=0)
+        mean *= factors[0]
+        return mean
+    return np.einsum('cb...,cb...->b...', body, factors) / body.shape[0]
+
+
+def calibrate_body(body, gains):
+    """
+    Calibrate every channel of a body.
+
+    args:
+        body (numpy.array): CHANNELS x BASELINES (x POLS) visibilities
+        gains (GainTable): the gains, or None
+
+    returns:
+        numpy.array: the body itself for unity gains, otherwise a calibrated
+                     copy
+    """
+    if gains is None or gains.unity:
+        return body
+    factors = gains.baseline_gains()
+    return body * factors.reshape(factors.shape + (1,) * (body.ndim - 2))
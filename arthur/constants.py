@@ -1,11 +1,14 @@
 from os import path
 
 IMAGE_RES = 256
+UV_CELL = 0.5  # uv cell size in wavelengths, 0.5 images the whole sky
 C_MS = 299792458.0
 NUM_ANTS = 288
 NUM_BSLN = int((NUM_ANTS ** 2 + NUM_ANTS) / 2)
 NUM_CHAN = 63
 NUM_POLS = 2
+SUBBAND_WIDTH = 195312.5  # Hz
+CHAN_WIDTH = SUBBAND_WIDTH / 64  # Hz, channel 0 of a subband is not used
 LEN_HDR = 512
 LEN_BDY = NUM_BSLN * NUM_POLS * NUM_CHAN * 8  # complex64 (8 bytes)
 
@@ -3,32 +3,78 @@ try:
 except ImportError:
     from backports.functools_lru_cache import lru_cache
 
-from arthur import constants
+import hashlib
+import logging
+import os
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+# rotates the ITRF antenna positions into the local horizon frame
+ROTATION = np.array([[-0.1195950000, -0.7919540000, 0.5987530000],
+                     [0.9928230000, -0.0954190000, 0.0720990000],
+                     [0.0000330000, 0.6030780000, 0.7976820000]])
+
 
 @lru_cache()
-def load_antpos(path):
+def load_antpos(path, with_w=False):
     """
-    Load antenna positions and compute U,V coordinates
+    Load antenna positions and compute U,V coordinates. The coordinates are
+    cached in a .npy file next to the antenna pos file and memory mapped, so
+    they are only computed once for all processes.
 
     args:
         path (str): path to antenna pos file
+        with_w (bool): also return the W coordinates
+
+    returns:
+        tuple: (numpy.array, numpy.array) or (U, V, W), read only
+    """
+    uvw = baselines(path)
+    return tuple(uvw[:3 if with_w else 2])
+
+
+def baselines(path, rotation=ROTATION):
+    """
+    The U, V and W coordinates of all antenna pairs, loaded from or stored
+    in the cache. Falls back to computing them if the cache can't be written.
+
+    args:
+        path (str): path to antenna pos file
+        rotation (numpy.array): 3x3 rotation matrix
+
+    returns:
+        numpy.array: 3 x NUM_ANTS x NUM_ANTS
+    """
+    with open(path, 'rb') as f:
+        key = hashlib.sha1(f.read() + rotation.tobytes()).hexdigest()[:16]
+    cache = '{}.{}.uvw.npy'.format(path, key)
+    if os.path.exists(cache):
+        return np.load(cache, mmap_mode='r')
+
+    uvw = compute_baselines(np.loadtxt(path), rotation)
+    tmp = '{}.{}.tmp'.format(cache, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            np.save(f, uvw)
+        os.replace(tmp, cache)
+    except OSError as e:
+        logger.debug("can't write uvw cache {}: {}".format(cache, e))
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        return uvw
+    return np.load(cache, mmap_mode='r')
+
+
+def compute_baselines(positions, rotation=ROTATION):
+    """
+    args:
+        positions (numpy.array): NUM_ANTS x 3 antenna positions
+        rotation (numpy.array): 3x3 rotation matrix
 
     returns:
-        tuple: (numpy.array, numpy.array)
+        numpy.array: 3 x NUM_ANTS x NUM_ANTS U, V and W coordinates
     """
-    A = np.loadtxt(path)
-    R = np.array([[-0.1195950000, -0.7919540000, 0.5987530000],
-                  [0.9928230000, -0.0954190000, 0.0720990000],
-                  [0.0000330000, 0.6030780000, 0.7976820000]])
-    L = A.dot(R)
-
-    U = np.zeros((constants.NUM_ANTS, constants.NUM_ANTS), dtype=np.float64)
-    V = np.zeros((constants.NUM_ANTS, constants.NUM_ANTS), dtype=np.float64)
-
-    for a1 in range(constants.NUM_ANTS):
-        for a2 in range(constants.NUM_ANTS):
-            U[a1, a2] = L[a1, 0] - L[a2, 0]
-            V[a1, a2] = L[a1, 1] - L[a2, 1]
-    return U, V
\ No newline at end of file
+    L = positions.dot(rotation)
+    uvw = L[:, None, :] - L[None, :, :]
+    return np.ascontiguousarray(np.moveaxis(uvw, -1, 0))
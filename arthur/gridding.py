@@ -1,5 +1,17 @@
+try:
+    from functools import lru_cache
+except ImportError:
+    from backports.functools_lru_cache import lru_cache
+
+import logging
 import numpy as np
+from scipy.sparse import csr_matrix, hstack, block_diag
 from arthur import constants
+from arthur.data import load_antpos
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('cython', 'numpy', 'python')
 
 
 def grid(U, V, C, duv, size):
@@ -34,3 +46,417 @@ def grid(U, V, C, duv, size):
             G[s, e] += south_east_power * C[a1, a2]
             G[n, e] += north_east_power * C[a1, a2]
     return G
+
+
+def grid_corners(U, V, duv, size, p=None):
+    """
+    Compute the four grid cells every visibility is deposited in, together
+    with their bilinear weights. This is the array version of the per
+    baseline arithmetic in grid().
+
+    args:
+        U (numpy.array): NUM_ANTS x NUM_ANTS u coordinates
+        V (numpy.array): NUM_ANTS x NUM_ANTS v coordinates
+        duv (float): size of a uv cell
+        size (int): size of the uv grid
+        p (numpy.array): the power per visibility, by default 0.5 on the
+                         diagonal (autocorrelations) and 1 elsewhere
+
+    returns:
+        tuple: (rows, cols, weights), each of shape U.shape + (4,). The
+               corners are ordered south west, north west, south east,
+               north east.
+    """
+    if p is None:
+        p = np.where(np.eye(*U.shape, dtype=bool), 0.5, 1.0)
+
+    u = U / duv + size / 2 - 1
+    v = V / duv + size / 2 - 1
+
+    w = np.floor(u)
+    e = np.ceil(u)
+    s = np.floor(v)
+    n = np.ceil(v)
+
+    west_power = p - (u - w)
+    east_power = p - (e - u)
+    south_power = p - (v - s)
+    north_power = p - (n - v)
+
+    rows = np.stack((s, n, s, n), axis=-1).astype(np.intp)
+    cols = np.stack((w, w, e, e), axis=-1).astype(np.intp)
+    weights = np.stack((south_power * west_power,
+                        north_power * west_power,
+                        south_power * east_power,
+                        north_power * east_power), axis=-1)
+    return rows, cols, weights
+
+
+def grid_vectorized(U, V, C, duv, size):
+    """
+    Vectorized version of grid(). All corner indices and weights are
+    computed as arrays and accumulated with an unbuffered scatter add, in
+    the same order and precision as the loop, so the result is identical.
+
+    args:
+        U (numpy.array): NUM_ANTS x NUM_ANTS u coordinates
+        V (numpy.array): NUM_ANTS x NUM_ANTS v coordinates
+        C (numpy.array): NUM_ANTS x NUM_ANTS correlation matrix
+        duv (float): size of a uv cell
+        size (int): size of the uv grid
+
+    returns:
+        numpy.array: size x size complex64 uv grid
+    """
+    rows, cols, weights = grid_corners(U, V, duv, size)
+    G = np.zeros((size, size), np.complex64)
+    np.add.at(G, (rows.ravel(), cols.ravel()),
+              (weights * C[..., np.newaxis]).ravel())
+    return G
+
+
+def on_grid(U, V, duv, size):
+    """
+    Which baselines the gridding plans keep: those of which all corners of
+    both (u, v) and (-u, -v) fall on the grid, so a visibility and its
+    conjugate are either both gridded or both left out.
+
+    args:
+        U (numpy.array): u coordinates
+        V (numpy.array): v coordinates
+        duv (float): size of a uv cell
+        size (int): size of the uv grid
+
+    returns:
+        numpy.array: booleans of the shape of U
+    """
+    inside = np.ones(U.shape, dtype=bool)
+    for sign in (1, -1):
+        rows, cols, _ = grid_corners(sign * U, sign * V, duv, size, 1.0)
+        inside &= ((rows >= 0) & (rows < size) &
+                   (cols >= 0) & (cols < size)).all(axis=-1)
+    return inside
+
+
+def _warn_outside(plan, frequency, size, cell):
+    if plan.outside:
+        logger.warning("{} baselines fall outside the {}x{} uv grid at "
+                       "{} Hz with {} wavelength cells and are left out, "
+                       "use larger cells".format(plan.outside, size, size,
+                                                 frequency, cell))
+
+
+def checkerboard(rows, cols):
+    """
+    The alternating sign (-1) ** (row + col) of grid cells. Multiplying an
+    even sized uv grid with it fftshifts the image made from it.
+    """
+    return 1 - 2 * ((rows + cols) % 2)
+
+
+class GriddingPlan(object):
+    """
+    A precomputed gridding operation. The target cells and weights only
+    depend on the antenna layout, the frequency and the grid size, so they
+    are stored once as a sparse matrix and gridding a correlation matrix
+    becomes a single sparse matrix vector product. Baselines that fall off
+    the grid are left out, see on_grid(), outside counts them.
+    """
+    def __init__(self, U, V, duv, size, shifted=False):
+        """
+        args:
+            U (numpy.array): NUM_ANTS x NUM_ANTS u coordinates
+            V (numpy.array): NUM_ANTS x NUM_ANTS v coordinates
+            duv (float): size of a uv cell
+            size (int): size of the (even) uv grid
+            shifted (bool): grid onto the fftshifted and flipped plane,
+                            with the checkerboard sign that centres the
+                            image. Its inverse FFT is the image, see
+                            arthur.imaging.make_image()
+        """
+        self.size = size
+        self.duv = duv
+        self.shifted = shifted
+        rows, cols, weights = grid_corners(U, V, duv, size)
+        sources = np.repeat(np.arange(U.size), 4).reshape(rows.shape)
+        inside = on_grid(U, V, duv, size)
+        self.outside = int(np.tril(~inside).sum())
+        inside = np.broadcast_to(inside[..., np.newaxis], rows.shape)
+        rows, cols = rows[inside], cols[inside]
+        weights, sources = weights[inside], sources[inside]
+        if shifted:
+            rows = (size - 1 - size // 2 - rows) % size
+            cols = (size - 1 - size // 2 - cols) % size
+            weights = weights * checkerboard(rows, cols)
+        self.matrix = csr_matrix((weights, (rows * size + cols, sources)),
+                                 shape=(size * size, U.size))
+
+    def grid(self, C):
+        """
+        Grid a correlation matrix.
+
+        args:
+            C (numpy.array): NUM_ANTS x NUM_ANTS correlation matrix
+
+        returns:
+            numpy.array: size x size complex64 uv grid
+        """
+        G = self.matrix.dot(C.ravel())
+        return G.reshape(self.size, self.size).astype(np.complex64)
+
+
+@lru_cache()
+def gridding_plan(frequency, size, antpos_path, cell=constants.UV_CELL,
+                  shifted=False):
+    """
+    Get the (cached) gridding plan for an observation.
+
+    args:
+        frequency (float): the frequency of the observation
+        size (int): size of the uv grid
+        antpos_path (str): path to antenna pos file
+        cell (float): size of a uv cell in wavelengths
+        shifted (bool): grid onto the plane that is imaged without shifts,
+                        see GriddingPlan
+
+    returns:
+        GriddingPlan
+    """
+    U, V = load_antpos(antpos_path)
+    duv = cell * constants.C_MS / frequency
+    plan = GriddingPlan(U, V, duv, size, shifted)
+    _warn_outside(plan, frequency, size, cell)
+    return plan
+
+
+class HermitianGriddingPlan(object):
+    """
+    A precomputed gridding operation on the unique baselines only.
+
+    The full uv grid is Hermitian, so the image only depends on one half of
+    it. The lower triangle of the correlation matrix, as delivered by
+    arthur.io.parse_body, is gridded directly onto the half plane that
+    numpy.fft.irfft2 expects. The fftshift and flip make_image applies
+    before the FFT are folded into the target indices, the fftshift of the
+    image into the signs of the weights, so the real inverse FFT of the
+    half plane is the centred image. Like in GriddingPlan, baselines that
+    fall off the grid are left out.
+    """
+    def __init__(self, U, V, duv, size):
+        """
+        args:
+            U (numpy.array): NUM_ANTS x NUM_ANTS u coordinates
+            V (numpy.array): NUM_ANTS x NUM_ANTS v coordinates
+            duv (float): size of a uv cell
+            size (int): size of the (even) uv grid
+        """
+        self.size = size
+        self.duv = duv
+        self.shape = (size, size // 2 + 1)
+        a1, a2 = np.tril_indices(U.shape[0])
+        baselines = a1.size
+
+        p = np.where(a1 == a2, 0.5, 1.0)
+        rows, cols, weights = grid_corners(U[a1, a2], V[a1, a2], duv, size, p)
+
+        # the diagonal is deposited once on the full grid, only the real
+        # part of it contributes to the image
+        weights *= p[:, np.newaxis]
+        sources = np.repeat(np.arange(baselines), 4).reshape(rows.shape)
+
+        # leave out the baselines that fall off the grid
+        inside = on_grid(U[a1, a2], V[a1, a2], duv, size)
+        self.outside = int((~inside).sum())
+        inside = np.broadcast_to(inside[..., np.newaxis], rows.shape)
+        rows, cols = rows[inside], cols[inside]
+        weights, sources = weights[inside], sources[inside]
+
+        # position in the shifted and flipped grid, and its mirror
+        rows = (size - 1 - size // 2 - rows) % size
+        cols = (size - 1 - size // 2 - cols) % size
+        # the mirror of an even sized grid has the same sign
+        weights *= checkerboard(rows, cols)
+        mirror_rows = -rows % size
+        mirror_cols = -cols % size
+
+        # a visibility lands on the half plane, its conjugate on the mirror
+        # position, and on the self mirroring columns both do.
+        direct = cols < self.shape[1]
+        mirror = mirror_cols < self.shape[1]
+        targets = np.concatenate((rows[direct] * self.shape[1] + cols[direct],
+                                  mirror_rows[mirror] * self.shape[1] +
+                                  mirror_cols[mirror]))
+        sources = np.concatenate((sources[direct],
+                                  sources[mirror] + baselines))
+        weights = np.concatenate((weights[direct], weights[mirror]))
+        self.matrix = csr_matrix((weights, (targets, sources)),
+                                 shape=(self.shape[0] * self.shape[1],
+                                        2 * baselines))
+
+    def grid(self, triangle):
+        """
+        Grid the unique baselines, of one or a stack of frames.
+
+        args:
+            triangle (numpy.array): the lower triangle of the correlation
+                                    matrix, NUM_BSLN visibilities, or
+                                    FRAMES x NUM_BSLN
+
+        returns:
+            numpy.array: size x (size // 2 + 1) complex64 half plane, or
+                         FRAMES x size x (size // 2 + 1)
+        """
+        if triangle.ndim == 1:
+            G = self.matrix.dot(np.concatenate((triangle,
+                                                np.conjugate(triangle))))
+            return G.reshape(self.shape).astype(np.complex64)
+        # all frames are gridded in one sparse product with many columns
+        X = np.concatenate((triangle, np.conjugate(triangle)), axis=1).T
+        G = self.matrix.dot(X).T.astype(np.complex64)
+        return G.reshape((triangle.shape[0],) + self.shape)
+
+
+@lru_cache()
+def hermitian_gridding_plan(frequency, size, antpos_path,
+                            cell=constants.UV_CELL):
+    """
+    Get the (cached) Hermitian gridding plan for an observation.
+
+    args:
+        frequency (float): the frequency of the observation
+        size (int): size of the uv grid
+        antpos_path (str): path to antenna pos file
+        cell (float): size of a uv cell in wavelengths
+
+    returns:
+        HermitianGriddingPlan
+    """
+    U, V = load_antpos(antpos_path)
+    duv = cell * constants.C_MS / frequency
+    plan = HermitianGriddingPlan(U, V, duv, size)
+    _warn_outside(plan, frequency, size, cell)
+    return plan
+
+
+class ChannelGriddingPlan(object):
+    """
+    Grids the unique baselines of all channels, each channel at its own
+    frequency, in one sparse matrix product for all polarizations. Either
+    all channels are gridded onto one half plane (multi frequency
+    synthesis), or every channel onto its own half plane.
+    """
+    def __init__(self, U, V, frequencies, size, mfs=True,
+                 cell=constants.UV_CELL):
+        """
+        args:
+            U (numpy.array): NUM_ANTS x NUM_ANTS u coordinates
+            V (numpy.array): NUM_ANTS x NUM_ANTS v coordinates
+            frequencies (list): the frequency of every channel
+            size (int): size of the uv grid
+            mfs (bool): grid all channels onto one plane
+            cell (float): size of a uv cell in wavelengths
+        """
+        self.size = size
+        self.mfs = mfs
+        self.channels = len(frequencies)
+        plans = [HermitianGriddingPlan(U, V, cell * constants.C_MS / f, size)
+                 for f in frequencies]
+        self.shape = plans[0].shape
+        self.baselines = plans[0].matrix.shape[1] // 2
+        # the highest frequency loses the most visibilities
+        self.outside = max(p.outside for p in plans)
+        combine = hstack if mfs else block_diag
+        # the weights are real, so the part of the plan working on the
+        # conjugated visibilities can be applied before conjugating.
+        self.direct = combine([p.matrix[:, :self.baselines] for p in plans],
+                              format='csr', dtype=np.float32)
+        self.mirror = combine([p.matrix[:, self.baselines:] for p in plans],
+                              format='csr', dtype=np.float32)
+
+    def grid(self, body):
+        """
+        Grid all channels and polarizations.
+
+        args:
+            body (numpy.array): CHANNELS x BASELINES x POLS visibilities
+
+        returns:
+            numpy.array: POLS x size x (size // 2 + 1) complex64 half planes
+                         for multi frequency synthesis, otherwise
+                         POLS x CHANNELS x size x (size // 2 + 1)
+        """
+        pols = body.shape[2]
+        visibilities = np.ascontiguousarray(body, dtype=np.complex64)
+        visibilities = visibilities.reshape(-1, pols)
+        G = self.direct.dot(visibilities)
+        G += np.conjugate(self.mirror.dot(visibilities))
+        planes = 1 if self.mfs else self.channels
+        G = G.reshape((planes,) + self.shape + (pols,))
+        G = np.moveaxis(G, -1, 0)
+        return G[:, 0] if self.mfs else G
+
+
+@lru_cache(maxsize=4)
+def channel_gridding_plan(frequencies, size, antpos_path, mfs=True,
+                          cell=constants.UV_CELL):
+    """
+    Get the (cached) multi channel gridding plan for an observation.
+
+    args:
+        frequencies (tuple): the frequency of every channel
+        size (int): size of the uv grid
+        antpos_path (str): path to antenna pos file
+        mfs (bool): grid all channels onto one plane
+        cell (float): size of a uv cell in wavelengths
+
+    returns:
+        ChannelGriddingPlan
+    """
+    U, V = load_antpos(antpos_path)
+    plan = ChannelGriddingPlan(U, V, frequencies, size, mfs, cell)
+    _warn_outside(plan, max(frequencies), size, cell)
+    return plan
+
+
+def available_backends():
+    """
+    returns:
+        list: the names of the gridding backends that can be used, fastest
+              first
+    """
+    return [name for name in BACKENDS if _load_backend(name) is not None]
+
+
+def _load_backend(name):
+    if name == 'python':
+        return grid
+    if name == 'numpy':
+        return grid_vectorized
+    if name == 'cython':
+        try:
+            from arthur.gridding_fast import grid as grid_fast
+        except ImportError:
+            return None
+        return grid_fast
+    raise ValueError("unknown gridding backend {}".format(name))
+
+
+def get_backend(name=None):
+    """
+    Select a gridding function. If the requested backend is not available
+    (the cython extension is not built) this falls back to numpy.
+
+    args:
+        name (str): one of BACKENDS, or None for the fastest available
+
+    returns:
+        function: a gridding function with the signature of grid()
+    """
+    if name is None:
+        name = available_backends()[0]
+    backend = _load_backend(name)
+    if backend is None:
+        logger.warning("gridding backend {} not available, falling back to "
+                       "numpy".format(name))
+        backend = grid_vectorized
+    return backend
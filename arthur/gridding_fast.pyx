@@ -1,60 +1,88 @@
-cimport numpy as np
+# cython: boundscheck=False, wraparound=False, cdivision=True
+cimport cython
+from cython.parallel cimport prange, threadid
+from libc.math cimport floor, ceil
 import numpy as np
-from arthur import constants
 
-# Include complex arithmetic
-cdef extern from "complex.h":
-    pass
 
 def grid(
-        np.ndarray[np.float64_t, ndim=2] U,
-        np.ndarray[np.float64_t, ndim=2] V,
-        np.ndarray[np.complex64_t, ndim=2] C,
-        float duv,
-        int size
+        const double[:, :] U,
+        const double[:, :] V,
+        const float complex[:, :] C,
+        double duv,
+        int size,
+        int num_threads=1
 ):
     """
-    Cythonified gridding function
+    Cythonified gridding function. The rows of the correlation matrix are
+    distributed over num_threads OpenMP threads, each gridding into its own
+    plane. The planes are summed afterwards. Without OpenMP support, or
+    with num_threads=1, the result is identical to arthur.gridding.grid.
+    Raises IndexError if visibilities fall off the grid, like the python
+    gridders do.
     """
+    cdef int ants = U.shape[0]
+    cdef int a1, a2, t
+    cdef int outside = 0
     cdef int w, e, s, n
-    cdef float p, u, v
-    cdef float west_power
-    cdef float east_power
-    cdef float south_power
-    cdef float north_power
-    cdef float south_west_power
-    cdef float north_west_power
-    cdef float south_east_power
-    cdef float north_east_power
-
-    G = np.zeros((size, size), np.complex64)
-    G.fill(0)
-    for a1 in range(constants.NUM_ANTS):
-        for a2 in range(constants.NUM_ANTS):
+    cdef double p, u, v
+    cdef double west_power
+    cdef double east_power
+    cdef double south_power
+    cdef double north_power
+    cdef double complex c
+
+    if num_threads < 1:
+        num_threads = 1
+
+    planes = np.zeros((num_threads, size, size), np.complex64)
+    cdef float complex[:, :, ::1] G = planes
+
+    for a1 in prange(ants, nogil=True, num_threads=num_threads,
+                     schedule='static'):
+        t = threadid()
+        for a2 in range(ants):
             p = 1.0
             if a1 == a2:
                 p = 0.5
 
-            u = U[a1, a2] / duv + size / 2 - 1
-            v = V[a1, a2] / duv + size / 2 - 1
+            u = U[a1, a2] / duv + size / 2.0 - 1
+            v = V[a1, a2] / duv + size / 2.0 - 1
 
-            w = int(np.floor(u))
-            e = int(np.ceil(u))
-            s = int(np.floor(v))
-            n = int(np.ceil(v))
+            w = <int>floor(u)
+            e = <int>ceil(u)
+            s = <int>floor(v)
+            n = <int>ceil(v)
 
             west_power = p - (u - w)
             east_power = p - (e - u)
             south_power = p - (v - s)
             north_power = p - (n - v)
 
-            south_west_power = south_power * west_power
-            north_west_power = north_power * west_power
-            south_east_power = south_power * east_power
-            north_east_power = north_power * east_power
+            # negative indices wrap around, like they do in numpy
+            if w < 0:
+                w = w + size
+            if e < 0:
+                e = e + size
+            if s < 0:
+                s = s + size
+            if n < 0:
+                n = n + size
+
+            if (w < 0 or w >= size or e < 0 or e >= size or
+                    s < 0 or s >= size or n < 0 or n >= size):
+                outside += 1
+                continue
+
+            c = C[a1, a2]
+            G[t, s, w] = <float complex>(G[t, s, w] + south_power * west_power * c)
+            G[t, n, w] = <float complex>(G[t, n, w] + north_power * west_power * c)
+            G[t, s, e] = <float complex>(G[t, s, e] + south_power * east_power * c)
+            G[t, n, e] = <float complex>(G[t, n, e] + north_power * east_power * c)
 
-            G[s, w] += south_west_power * C[a1, a2]
-            G[n, w] += north_west_power * C[a1, a2]
-            G[s, e] += south_east_power * C[a1, a2]
-            G[n, e] += north_east_power * C[a1, a2]
-    return G
+    if outside:
+        raise IndexError("{} visibilities fall outside the {}x{} uv grid, "
+                         "use larger uv cells".format(outside, size, size))
+    if num_threads == 1:
+        return planes[0]
+    return planes.sum(axis=0, dtype=np.complex64)
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+class History(object):
+    """
+    A fixed size ring buffer holding the rows of the last depth frames, for
+    example the channel power or lag. Every row is stored twice, so the
+    rows are always available in order as one contiguous view without
+    copying, and adding a row is O(1).
+    """
+    def __init__(self, depth=60, shape=(), dtype=np.float32):
+        """
+        args:
+            depth (int): number of rows to keep
+            shape (tuple): the shape of a row
+            dtype (numpy.dtype): the type of the rows
+        """
+        self.depth = depth
+        self.shape = shape
+        self.count = 0
+        self._buffer = np.zeros((2 * depth,) + tuple(shape), dtype=dtype)
+        self._index = 0
+
+    def push(self, row):
+        """
+        Add a row, dropping the oldest one if the history is full.
+        """
+        self._buffer[self._index] = row
+        self._buffer[self._index + self.depth] = row
+        self._index = (self._index + 1) % self.depth
+        self.count += 1
+
+    def view(self, full=False):
+        """
+        args:
+            full (bool): include the zero rows of a history that is not
+                         filled up yet
+
+        returns:
+            numpy.array: the rows, oldest first. This is a view, it changes
+                         when new rows are pushed.
+        """
+        rows = self.depth if full else len(self)
+        end = self._index + self.depth
+        return self._buffer[end - rows:end]
+
+    def __len__(self):
+        return min(self.count, self.depth)
@@ -1,9 +1,124 @@
+try:
+    from functools import lru_cache
+except ImportError:
+    from backports.functools_lru_cache import lru_cache
+
+import logging
 import time
 from datetime import datetime
 import numpy as np
+import scipy.fft
+from scipy.fft import next_fast_len
 from arthur import constants
+from arthur.calibration import (apply_gains, apply_gains_triangle,
+                                calibrate_body, calibrated_mean)
 from arthur.data import load_antpos
-from arthur.gridding import grid
+from arthur.history import History
+from arthur.gridding import (checkerboard, gridding_plan,
+                             hermitian_gridding_plan, channel_gridding_plan)
+
+logger = logging.getLogger(__name__)
+
+FFT_BACKENDS = ('scipy', 'numpy')
+
+
+class NumpyFFT(object):
+    """
+    The FFTs of the imaging, with numpy.fft. Single threaded, the input is
+    never overwritten. The inverse transforms are not normalized, like the
+    forward ones.
+    """
+    name = 'numpy'
+
+    def fft2(self, a, overwrite=False):
+        return np.fft.fft2(a)
+
+    def ifft2(self, a, overwrite=False):
+        return np.fft.ifft2(a, norm='forward')
+
+    def irfft2(self, a, s, overwrite=False):
+        return np.fft.irfft2(a, s=s, norm='forward')
+
+
+class ScipyFFT(NumpyFFT):
+    """
+    The FFTs of the imaging, with scipy.fft. Stays in single precision,
+    runs on worker threads and reuses its cached plans. With overwrite the
+    input may be used as the output, the imaging functions only allow that
+    for uv grids they own.
+    """
+    name = 'scipy'
+
+    def __init__(self, workers=-1):
+        """
+        args:
+            workers (int): number of threads per transform, -1 for all
+                           CPUs
+        """
+        self.workers = workers
+
+    def fft2(self, a, overwrite=False):
+        return scipy.fft.fft2(a, overwrite_x=overwrite, workers=self.workers)
+
+    def ifft2(self, a, overwrite=False):
+        return scipy.fft.ifft2(a, norm='forward', overwrite_x=overwrite,
+                               workers=self.workers)
+
+    def irfft2(self, a, s, overwrite=False):
+        return scipy.fft.irfft2(a, s=s, norm='forward', overwrite_x=overwrite,
+                                workers=self.workers)
+
+
+def get_fft_backend(name=None, workers=-1):
+    """
+    Create an FFT backend.
+
+    args:
+        name (str): one of FFT_BACKENDS, or None for the fastest
+        workers (int): number of threads per transform, if the backend
+                       supports threads. -1 for all CPUs.
+
+    returns:
+        NumpyFFT: or an object with the same methods
+    """
+    if name is None:
+        name = FFT_BACKENDS[0]
+    if name == 'scipy':
+        return ScipyFFT(workers)
+    if name == 'numpy':
+        return NumpyFFT()
+    raise ValueError("unknown FFT backend {}".format(name))
+
+
+_fft_backend = None
+
+
+def fft_backend():
+    """
+    returns:
+        NumpyFFT: the FFT backend the imaging functions use, scipy.fft on
+                  all CPUs unless set with set_fft_backend()
+    """
+    global _fft_backend
+    if _fft_backend is None:
+        _fft_backend = get_fft_backend()
+    return _fft_backend
+
+
+def set_fft_backend(backend):
+    """
+    Select the FFT backend of the imaging functions in this process.
+
+    args:
+        backend (str or NumpyFFT): one of FFT_BACKENDS or a backend object,
+                                   None for the default
+    """
+    global _fft_backend
+    if backend is not None and not hasattr(backend, 'irfft2'):
+        backend = get_fft_backend(backend)
+    logger.info("imaging with the {} FFT backend".format(
+        getattr(backend, 'name', backend)))
+    _fft_backend = backend
 
 
 def correlation_matrix(data, antennas):
@@ -30,69 +145,365 @@ def calc_channels(data):
     """
     Construct the mean normalized absolute value per channel in dB scale
     """
-    pol = np.abs(data.mean(axis=1))
+    return channel_power(data.mean(axis=1))
+
+
+def channel_power(channel_means):
+    """
+    The absolute value of the per channel baseline means in dB scale
+    """
+    pol = np.abs(channel_means)
     # prevent div by zero
     if np.sum(pol) > 0:
         pol = 10.0 * np.log10(pol)
     return pol
 
 
-def make_image(cm, frequency):
+def fft_size(size):
+    """
+    The size of the uv grid and FFT for a size x size image: the next even
+    size that the FFT handles fast. The image is cropped to size again.
+
+    args:
+        size (int): the (even) size of the image
+
+    returns:
+        int
+    """
+    fft_size_ = next_fast_len(size, real=True)
+    while fft_size_ % 2:
+        fft_size_ = next_fast_len(fft_size_ + 1, real=True)
+    return fft_size_
+
+
+def grid_geometry(size, cell=constants.UV_CELL):
+    """
+    The uv grid for a size x size image. A padded grid gets smaller cells,
+    so the pixels of the cropped image stay the same size.
+
+    args:
+        size (int): the size of the image
+        cell (float): the size of a uv cell in wavelengths for an unpadded
+                      grid, 0.5 images the whole sky
+
+    returns:
+        tuple: (grid size, uv cell size in wavelengths)
+    """
+    padded = fft_size(size)
+    return padded, cell * size / padded
+
+
+def crop(images, size):
+    """
+    Cut the central size x size pixels from (a stack of) padded images.
+    """
+    start = images.shape[-1] // 2 - size // 2
+    if start == 0 and images.shape[-1] == size:
+        return images
+    return images[..., start:start + size, start:start + size]
+
+
+def _store(image, out):
+    """ the real part of image, in out if given """
+    if out is None:
+        return np.real(image)
+    np.copyto(out, np.real(image))
+    return out
+
+
+@lru_cache(maxsize=8)
+def _grid_checkerboard(size):
+    board = checkerboard(*np.indices((size, size))).astype(np.float32)
+    board.setflags(write=False)
+    return board
+
+
+@lru_cache(maxsize=8)
+def _image_phase(padded, size):
+    """
+    The phase that turns the FFT of a checkerboarded grid into the image
+    of make_image(), for the cropped pixels. Per axis an FFT of the flipped
+    and fftshifted grid is (-1) ** (h - 1) * exp(2j * pi * k * (h - 1) / N)
+    times the FFT of the grid itself, with h = N / 2, conjugated. Only the
+    real part of the image is kept, so the conjugate is left out.
     """
-    Create an image from the correlation matrix
+    half = padded // 2
+    k = np.arange(padded)
+    phase = (-1) ** (half - 1) * np.exp(2j * np.pi * k * (half - 1) / padded)
+    phase = crop(np.outer(phase, phase), size).astype(np.complex64)
+    real, imag = phase.real.copy(), phase.imag.copy()
+    real.setflags(write=False)
+    imag.setflags(write=False)
+    return real, imag
+
+
+def make_image(cm, frequency, gridder=None, gains=None,
+               size=constants.IMAGE_RES, cell=constants.UV_CELL, out=None):
+    """
+    Create an image from the correlation matrix. The fftshift, flip and
+    conjugate of the uv grid and the fftshift of the image are folded into
+    the gridding plan, or for a gridder into the signs of the grid and the
+    phase of the FFT, so no intermediate grids are made.
+
+    args:
+        cm (numpy.array): the correlation matrix, calibrated in place if
+                          gains are given
+        frequency (float): the frequency of the observation
+        gridder (function): grid with this function, for example
+                            arthur.gridding.grid, instead of with the cached
+                            gridding plan
+        gains (arthur.calibration.GainTable): calibrate with these gains
+        size (int): the size of the image
+        cell (float): the size of a uv cell in wavelengths, sets the field
+                      of view
+        out (numpy.array): write the image in this size x size array
     """
-    # No calibration vector applied
-    gains = np.ones((1, constants.NUM_ANTS), dtype=np.complex64)
-    cal_mat = gains.conj().transpose() * gains
+    apply_gains(cm, gains)
 
-    # Apply supplied calibration vector
-    cm = cal_mat * cm
+    padded, padded_cell = grid_geometry(size, cell)
+    fft = fft_backend()
+    if gridder is None:
+        plan = gridding_plan(frequency, padded, constants.ANTPOS, padded_cell,
+                             shifted=True)
+        # the real part of the FFT of the conjugate is that of the inverse
+        image = fft.ifft2(plan.grid(cm), overwrite=True)
+        return _store(crop(image, size), out)
 
     U, V = load_antpos(constants.ANTPOS)
-    mDuv = constants.C_MS / frequency / 2.0
-    gridvis = grid(U, V, cm, mDuv, constants.IMAGE_RES)
-    gridvis = np.fft.fftshift(gridvis)
-    gridvis = np.flipud(np.fliplr(gridvis))
-    gridvis = np.conjugate(gridvis)
-    return np.real(np.fft.fftshift(np.fft.fft2(gridvis)))
+    mDuv = padded_cell * constants.C_MS / frequency
+    gridvis = gridder(U, V, cm, mDuv, padded)
+    gridvis *= _grid_checkerboard(padded)
+    image = crop(fft.fft2(gridvis, overwrite=True), size)
+    real, imag = _image_phase(padded, size)
+    out = np.multiply(image.real, real, out=out)
+    out -= image.imag * imag
+    return out
 
 
-def historical_channels(body, new_row):
+def make_image_hermitian(triangle, frequency, gains=None,
+                         size=constants.IMAGE_RES, cell=constants.UV_CELL,
+                         out=None):
     """
-    Make a matrix of historical channel data
+    Create an image from the unique baselines only. Only half of the uv
+    plane is gridded and imaged with a real valued inverse FFT, the result
+    is the same as make_image() on the full correlation matrix.
+
+    args:
+        triangle (numpy.array): the lower triangle of the correlation matrix,
+                                for example the channel mean of a body.
+                                Calibrated in place if gains are given.
+        frequency (float): the frequency of the observation
+        gains (arthur.calibration.GainTable): calibrate with these gains
+        size (int): the size of the image
+        cell (float): the size of a uv cell in wavelengths
+        out (numpy.array): write the image in this size x size array
+    """
+    apply_gains_triangle(triangle, gains)
+    padded, padded_cell = grid_geometry(size, cell)
+    plan = hermitian_gridding_plan(frequency, padded, constants.ANTPOS,
+                                   padded_cell)
+    image = fft_backend().irfft2(plan.grid(triangle), (padded, padded),
+                                 overwrite=True)
+    return _store(crop(image, size), out)
+
+
+def channel_frequencies(frequency, channels=constants.NUM_CHAN):
+    """
+    The frequency of every channel of a subband.
 
-    TODO: add history
+    args:
+        frequency (float): the central frequency of the subband
+        channels (int): the number of channels
+
+    returns:
+        numpy.array
+    """
+    return frequency + (np.arange(channels) - (channels - 1) / 2.0) * \
+        constants.CHAN_WIDTH
+
+
+def make_image_cube(body, frequency, mfs=True, gains=None,
+                    size=constants.IMAGE_RES, cell=constants.UV_CELL):
+    """
+    Image all channels and polarizations of a body, every channel gridded
+    at its own frequency. The uv planes of all polarizations (and Stokes I)
+    and channels are imaged with one batched FFT.
+
+    args:
+        body (numpy.array): CHANNELS x BASELINES x POLS visibilities, as
+                            returned by parse_body(raw, pol=(0, 1))
+        frequency (float): the central frequency of the subband
+        mfs (bool): combine all channels into one image (multi frequency
+                    synthesis), otherwise make an image per channel
+        gains (arthur.calibration.GainTable): calibrate every channel with
+                                              these gains
+        size (int): the size of the images
+        cell (float): the size of a uv cell in wavelengths
+
+    returns:
+        numpy.array: images for XX, YY and Stokes I (or for each selected
+                     polarization if there are not two), so 3 x size x size,
+                     or 3 x CHANNELS x size x size without mfs
+    """
+    if body.ndim == 2:
+        body = body[..., np.newaxis]
+    body = calibrate_body(body, gains)
+    frequencies = tuple(channel_frequencies(frequency, body.shape[0]))
+    padded, padded_cell = grid_geometry(size, cell)
+    plan = channel_gridding_plan(frequencies, padded, constants.ANTPOS, mfs,
+                                 padded_cell)
+    gridvis = plan.grid(body)
+    if mfs:
+        gridvis /= body.shape[0]
+    if gridvis.shape[0] == 2:
+        stokes_i = (gridvis[0] + gridvis[1]) / 2
+        gridvis = np.concatenate((gridvis, stokes_i[np.newaxis]))
+    images = fft_backend().irfft2(gridvis, (padded, padded), overwrite=True)
+    return crop(images, size)
+
+
+def historical_channels(body, history=None):
+    """
+    Make a matrix of historical channel data
 
     args:
-        body (numpy.array): a sky image
+        body (numpy.array): a CHANNELS x BASELINES body
+        history (arthur.history.History): the channel history to add to, a
+                                          new one if not given
     returns:
-        numpy.array: a matrix containing historical channel data
+        numpy.array: a CHANNELS x depth matrix containing historical channel
+                     data, newest first
 
     """
-    chan_data = np.zeros((constants.NUM_CHAN, 60), dtype=np.float32)
-    chan_data = np.roll(chan_data, 1)
-    chan_data[:, 0] = calc_channels(body)
-    return chan_data
+    if history is None:
+        history = History(shape=(constants.NUM_CHAN,))
+    history.push(calc_channels(body))
+    return history.view(full=True)[::-1].T
 
 
 def calculate_lag(date):
     return datetime.now() - date
 
 
-def historical_lag(start_time):
-    # lag
-    lag_data = np.zeros(60, dtype=np.float32)
-    lag_data = np.roll(lag_data, 1)
-    lag_data[0] = (time.time() - start_time) - 1.0
+def historical_lag(start_time, history=None):
+    """
+    Make an array of historical lag data
+
+    args:
+        start_time (float): time the frame started, as from time.time()
+        history (arthur.history.History): the lag history to add to, a new
+                                          one if not given
+    returns:
+        numpy.array: the lag history, oldest first
+    """
+    if history is None:
+        history = History()
+    history.push((time.time() - start_time) - 1.0)
+    return history.view()
+
+
+def full_calculation(body, frequency, gains=None, size=constants.IMAGE_RES,
+                     cell=constants.UV_CELL, out=None):
+    """
+    args:
+        body (numpy.array): a CHANNELS x BASELINES body
+        frequency (float): the central frequency
+        gains (arthur.calibration.GainTable): calibrate with these gains
+        size (int): the size of the image
+        cell (float): the size of a uv cell in wavelengths
+        out (numpy.array): write the image in this size x size array
+
+    returns:
+        tuple: image, correlation matrix amplitudes, channel power
+    """
+    return triangle_calculation(calibrated_mean(body, gains),
+                                body.mean(axis=1), frequency, size, cell, out)
+
+
+def triangle_calculation(triangle, channel_means, frequency,
+                         size=constants.IMAGE_RES, cell=constants.UV_CELL,
+                         out=None):
+    """
+    full_calculation() on the channel averaged visibilities of a frame, or
+    of a whole window as integrated by arthur.integration.Integrator.
 
+    args:
+        triangle (numpy.array): the lower triangle of the (calibrated)
+                                correlation matrix, averaged over the
+                                channels
+        channel_means (numpy.array): the mean over the baselines per channel
+        frequency (float): the central frequency
+        size (int): the size of the image
+        cell (float): the size of a uv cell in wavelengths
+        out (numpy.array): write the image in this size x size array
 
-def full_calculation(body, frequency):
+    returns:
+        tuple: image, correlation matrix amplitudes, channel power
+    """
     # correlation matrix
-    cm = correlation_matrix(body, constants.NUM_ANTS)
+    cm = correlation_matrix(triangle[np.newaxis], constants.NUM_ANTS)
     corr_data = np.abs(cm)
     corr_data[np.diag_indices(constants.NUM_ANTS)] = np.min(corr_data)
 
-    image = make_image(cm, frequency)
-    chan_row = calc_channels(body)
+    image = make_image_hermitian(triangle, frequency, size=size, cell=cell,
+                                 out=out)
+    chan_row = channel_power(channel_means)
+
+    return image, corr_data, chan_row
+
+
+def image_batch(bodies, frequency, gains=None, size=constants.IMAGE_RES,
+                cell=constants.UV_CELL):
+    """
+    full_calculation() for a stack of frames at once, for offline
+    reprocessing. All frames share one gridding plan, are gridded with one
+    sparse product and imaged with one batched FFT. Memory use grows with
+    the number of frames, feed long files in chunks of some tens of frames.
+
+    args:
+        bodies (numpy.array): FRAMES x CHANNELS x BASELINES visibilities, for
+                              example from arthur.io.VisFile.bodies()
+        frequency (float): the central frequency
+        gains (arthur.calibration.GainTable): calibrate with these gains
+        size (int): the size of the images
+        cell (float): the size of a uv cell in wavelengths
+
+    returns:
+        tuple: images (FRAMES x size x size), correlation matrix
+               amplitudes (FRAMES x NUM_ANTS x NUM_ANTS) and channel power
+               (FRAMES x CHANNELS)
+    """
+    frames, channels, baselines = bodies.shape
+    # the means are matrix products, which are a lot faster than mean()
+    if gains is None or gains.unity or gains.channels == 1:
+        weights = np.full(channels, 1.0 / channels, dtype=bodies.dtype)
+        triangles = np.matmul(weights, bodies)
+        if gains is not None and not gains.unity:
+            triangles *= gains.baseline_gains(mean=True)
+    else:
+        triangles = np.einsum('fcb,cb->fb', bodies, gains.baseline_gains())
+        triangles /= channels
+
+    a1, a2 = np.tril_indices(constants.NUM_ANTS)
+    corr_data = np.empty((frames, constants.NUM_ANTS, constants.NUM_ANTS),
+                         dtype=np.float32)
+    amplitudes = np.abs(triangles)
+    corr_data[:, a1, a2] = amplitudes
+    corr_data[:, a2, a1] = amplitudes
+    diagonal = np.arange(constants.NUM_ANTS)
+    corr_data[:, diagonal, diagonal] = corr_data.min(axis=(1, 2))[:, np.newaxis]
+
+    padded, padded_cell = grid_geometry(size, cell)
+    plan = hermitian_gridding_plan(frequency, padded, constants.ANTPOS,
+                                   padded_cell)
+    gridvis = plan.grid(triangles)
+    images = crop(fft_backend().irfft2(gridvis, (padded, padded),
+                                       overwrite=True), size)
+
+    weights = np.full(baselines, 1.0 / baselines, dtype=bodies.dtype)
+    chan_rows = np.abs(np.matmul(bodies, weights))
+    # prevent div by zero
+    positive = chan_rows.sum(axis=1) > 0
+    chan_rows[positive] = 10.0 * np.log10(chan_rows[positive])
 
-    return image, corr_data, chan_row
\ No newline at end of file
+    return images, corr_data, chan_rows
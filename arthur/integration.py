@@ -0,0 +1,169 @@
+import logging
+import numpy as np
+from arthur import constants
+from arthur.calibration import calibrated_mean
+
+logger = logging.getLogger(__name__)
+
+
+class Integrator(object):
+    """
+    Integrates frames over a window of N frames or T seconds, so an image
+    is only made once per window. Keeps running sums of the channel
+    averaged visibilities (the lower triangle of the correlation matrix)
+    and of the per channel baseline means, which is all imaging needs.
+
+    Tumbling windows emit and start over when full. Sliding windows keep
+    the contribution of every frame in a preallocated ring, so the oldest
+    frame is subtracted again in constant time. They emit every step frames
+    once full. The sums are complex128, so repeated adding and subtracting
+    doesn't drift.
+    """
+    def __init__(self, frames=None, seconds=None, sliding=False, step=1,
+                 frame_seconds=1.0, baselines=constants.NUM_BSLN,
+                 channels=constants.NUM_CHAN):
+        """
+        args:
+            frames (int): window length in frames
+            seconds (float): window length in seconds, frames are dated by
+                             their start
+            sliding (bool): sliding instead of tumbling windows
+            step (int): emit a sliding window every step frames
+            frame_seconds (float): the length of a frame
+            baselines (int): number of baselines in a body
+            channels (int): number of channels in a body
+        """
+        if not frames and not seconds:
+            raise ValueError("give a window length in frames or seconds")
+        self.frames = frames
+        self.seconds = seconds
+        self.sliding = sliding
+        self.step = step
+        self.frame_seconds = frame_seconds
+        if frames:
+            self.capacity = frames
+        else:
+            self.capacity = int(np.ceil(seconds / frame_seconds))
+        self._triangle = np.zeros(baselines, dtype=np.complex128)
+        self._channels = np.zeros(channels, dtype=np.complex128)
+        self._dates = [None] * self.capacity
+        self._first = 0
+        self._count = 0
+        self._since = 0
+        if sliding:
+            self._triangles = np.zeros((self.capacity, baselines),
+                                       dtype=np.complex64)
+            self._channel_rows = np.zeros((self.capacity, channels),
+                                          dtype=np.complex64)
+
+    def __len__(self):
+        """ the number of frames in the current window """
+        return self._count
+
+    def push(self, date, body, gains=None):
+        """
+        Add a frame to the window.
+
+        args:
+            date (datetime.datetime): start of the frame
+            body (numpy.array): CHANNELS x BASELINES visibilities
+            gains (arthur.calibration.GainTable): calibrate the frame with
+                                                  these gains
+
+        returns:
+            tuple: (date, triangle, channel means) averaged over the window
+                   when it is emitted, dated by its last frame, otherwise
+                   None. See arthur.imaging.triangle_calculation()
+        """
+        triangle = calibrated_mean(body, gains)
+        channels = body.mean(axis=1)
+
+        result = None
+        if self.sliding:
+            self._evict(date)
+        elif self._count and not self._fits(date):
+            # a gap in the frames, close the window without this frame
+            result = self._emit()
+            self._reset()
+
+        slot = (self._first + self._count) % self.capacity
+        if self.sliding:
+            self._triangles[slot] = triangle
+            self._channel_rows[slot] = channels
+        self._triangle += triangle
+        self._channels += channels
+        self._dates[slot] = date
+        self._count += 1
+        self._since += 1
+
+        if result is None and self._full():
+            if not self.sliding:
+                result = self._emit()
+                self._reset()
+            elif self._since >= self.step:
+                result = self._emit()
+                self._since = 0
+        return result
+
+    def _fits(self, date):
+        """ does date fit in the window with the oldest frame """
+        if self._count >= self.capacity:
+            return False
+        if self.seconds:
+            oldest = self._dates[self._first]
+            span = (date - oldest).total_seconds() + self.frame_seconds
+            return span <= self.seconds
+        return True
+
+    def _full(self):
+        if self._count >= self.capacity:
+            return True
+        if self.seconds:
+            oldest = self._dates[self._first]
+            newest = self._dates[(self._first + self._count - 1) %
+                                 self.capacity]
+            span = (newest - oldest).total_seconds() + self.frame_seconds
+            return span >= self.seconds
+        return False
+
+    def _evict(self, date):
+        """ subtract the frames that fall out of a sliding window """
+        while self._count and not self._fits(date):
+            self._triangle -= self._triangles[self._first]
+            self._channels -= self._channel_rows[self._first]
+            self._dates[self._first] = None
+            self._first = (self._first + 1) % self.capacity
+            self._count -= 1
+
+    def _emit(self):
+        newest = self._dates[(self._first + self._count - 1) % self.capacity]
+        logger.debug("integrated {} frames up to {}".format(self._count,
+                                                            newest))
+        return (newest,
+                (self._triangle / self._count).astype(np.complex64),
+                (self._channels / self._count).astype(np.complex64))
+
+    def _reset(self):
+        self._triangle.fill(0)
+        self._channels.fill(0)
+        self._first = 0
+        self._count = 0
+        self._since = 0
+
+
+def integrate(generator, integrator, gains=None):
+    """
+    Integrate the frames of a generator.
+
+    args:
+        generator (iterable): yields (date, body) frames
+        integrator (Integrator): the window to integrate over
+        gains (arthur.calibration.GainTable): calibrate with these gains
+
+    returns:
+        generator: yields (date, triangle, channel means) per window
+    """
+    for date, body in generator:
+        result = integrator.push(date, body, gains)
+        if result is not None:
+            yield result
@@ -1,10 +1,15 @@
+import asyncio
+import calendar
+import mmap
+import os
 import struct
 from datetime import datetime
 import numpy as np
 from arthur import constants
 import socket
 import logging
-from six import BytesIO
+import threading
+import weakref
 
 try:
     from functools import lru_cache
@@ -30,70 +35,157 @@ def parse_header(raw_header):
     return start, end
 
 
-def parse_body(raw_body):
+def parse_body(raw_body, pol=0, copy=False):
     """
-    parse a raw set of bytes and return a reshaped numpy array
+    parse a raw set of bytes and return a reshaped numpy array. The result
+    is a strided view on raw_body, nothing is copied unless asked for.
 
     args:
-        raw_body (bytes): the raw matrix
+        raw_body (bytes): the raw matrix, or any object supporting the
+                          buffer protocol
+        pol (int or tuple): which polarization(s) to select
+        copy (bool): return a contiguous copy instead of a view
 
     returns:
-        numpy.array
+        numpy.array: CHANNELS x BASELINES, or CHANNELS x BASELINES x POLS if
+                     a tuple of polarizations is selected
     """
-    serial_body = np.fromstring(raw_body,  dtype=np.complex64)
-    indices = create_indices(0, constants.NUM_CHAN, constants.NUM_BSLN,
-                             constants.NUM_POLS)
-    body = reshape_body(serial_body, indices, constants.NUM_CHAN,
-                        constants.NUM_BSLN)
+    serial_body = np.frombuffer(raw_body, dtype=np.complex64,
+                                count=constants.LEN_BDY // 8)
+    cube = serial_body.reshape(constants.NUM_BSLN, constants.NUM_CHAN,
+                               constants.NUM_POLS).swapaxes(0, 1)
+    body = _select_pol(cube, pol)
+    if copy:
+        body = np.ascontiguousarray(body)
     return body
 
 
-def reader(producer, bytes_):
+def _select_pol(cube, pol):
+    """
+    select polarization(s) from the last axis of cube
+    """
+    if isinstance(pol, (tuple, list)):
+        # a regular selection like (0, 1) is a view, anything else a copy
+        step = pol[1] - pol[0] if len(pol) > 1 else 1
+        if step > 0 and list(pol) == list(range(pol[0], pol[-1] + 1, step)):
+            pol = slice(pol[0], pol[-1] + 1, step)
+        else:
+            pol = list(pol)
+    return cube[..., pol]
+
+
+class BufferPool(object):
+    """
+    A pool of reusable receive buffers, each large enough to hold one frame.
+    A buffer is handed out as a uint8 numpy array and goes back into the
+    pool as soon as that array, and every array parsed from it, is garbage
+    collected.
     """
-    Read an amount of bytes from a socket or file
+    def __init__(self, size=4, length=constants.LEN_HDR + constants.LEN_BDY):
+        """
+        args:
+            size (int): maximum number of idle buffers to keep around
+            length (int): length of a buffer in bytes
+        """
+        self.size = size
+        self.length = length
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self, length=None):
+        """
+        Get a buffer from the pool, allocate a new one if the pool is empty.
+
+        args:
+            length (int): length of the returned view, at most self.length
+
+        returns:
+            numpy.array
+        """
+        with self._lock:
+            buffer_ = self._free.pop() if self._free else None
+        if buffer_ is None:
+            logger.debug("allocating new receive buffer")
+            buffer_ = bytearray(self.length)
+        # arrays derived from view keep it alive, not just buffer_
+        view = np.frombuffer(buffer_, dtype=np.uint8, count=length or -1)
+        weakref.finalize(view, self._release, buffer_)
+        return view
+
+    def _release(self, buffer_):
+        with self._lock:
+            if len(self._free) < self.size:
+                self._free.append(buffer_)
+
+    def __len__(self):
+        return len(self._free)
+
+
+def reader(producer, bytes_, buffer_=None):
+    """
+    Read an amount of bytes from a socket or file into a buffer.
 
     args:
         producer: a socket or file object
         bytes_ (int): number of bytes to read
+        buffer_: a writable buffer of bytes_ length to read into,
+                 allocated if not given
 
     returns:
-        bytes: the read data
+        the buffer containing the read data
     """
+    if buffer_ is None:
+        buffer_ = bytearray(bytes_)
+    view = memoryview(buffer_)
+    count = 0
     if type(producer) == socket.socket:
-        result = BytesIO()
-        count = bytes_
-        while count > 0:
-            recv = producer.recv(count)
-            if len(recv) == 0:
+        while count < bytes_:
+            recv = producer.recv_into(view[count:], bytes_ - count)
+            if recv == 0:
                 logger.warning("client closed connection")
                 producer.close()
                 raise IOError("client closed connection")
-
-            count -= len(recv)
-            result.write(recv)
-        return result.getvalue()
+            count += recv
+    elif hasattr(producer, 'readinto'):
+        while count < bytes_:
+            read = producer.readinto(view[count:bytes_])
+            if not read:
+                logger.warning("end of file")
+                raise IOError("end of file")
+            count += read
     else:
         # assuming file like interface
         data = producer.read(bytes_)
         if len(data) != bytes_:
             logger.warning("end of file")
             raise IOError("end of file")
-        return data
+        view[:bytes_] = data
+    return buffer_
 
 
-def read_data(handler):
+def read_data(handler, pool=None):
     """
     read one data window from a file or socket like object.
 
     args:
         handler: an object with a file like interface (read)
+        pool (BufferPool): read into a buffer from this pool. The body is
+                           then a view on that buffer, which is recycled
+                           once the body is released.
 
     returns:
         tuple (date, body)
     """
-    raw_header = reader(handler, constants.LEN_HDR)
+    if pool is None:
+        raw_header = reader(handler, constants.LEN_HDR)
+        raw_body = reader(handler, constants.LEN_BDY)
+    else:
+        frame = pool.acquire(constants.LEN_HDR + constants.LEN_BDY)
+        raw_header = reader(handler, constants.LEN_HDR,
+                            frame[:constants.LEN_HDR])
+        raw_body = reader(handler, constants.LEN_BDY,
+                          frame[constants.LEN_HDR:])
     start_time, end_time = parse_header(raw_header)
-    raw_body = reader(handler, constants.LEN_BDY)
     body = parse_body(raw_body)
     date = datetime.utcfromtimestamp(start_time)
     return date, body
@@ -113,7 +205,140 @@ def read_full(path):
         try:
             yield read_data(handler)
         except IOError:
-            raise StopIteration
+            return
+
+
+class VisFile(object):
+    """
+    Random access to the frames of a visibilities file. The file is memory
+    mapped and indexed on the fixed LEN_HDR + LEN_BDY frame layout, so any
+    frame can be accessed in constant time without reading the file. Bodies
+    are views on the mapped file.
+    """
+    frame_length = constants.LEN_HDR + constants.LEN_BDY
+
+    def __init__(self, path, pol=0):
+        """
+        args:
+            path (str): a path to a visibilities file
+            pol (int or tuple): which polarization(s) to select, see
+                                parse_body()
+        """
+        self.path = path
+        self.pol = pol
+        with open(path, 'rb') as handler:
+            # an empty file can't be mapped, one without a header is no
+            # visibility file either
+            if os.fstat(handler.fileno()).st_size < constants.LEN_HDR:
+                raise IOError("frame 0 in {} has no valid header".format(path))
+            self._mmap = mmap.mmap(handler.fileno(), 0, access=mmap.ACCESS_READ)
+        frames, remainder = divmod(len(self._mmap), self.frame_length)
+        if remainder:
+            logger.warning("{} ends with an incomplete frame".format(path))
+
+        def header_field(dtype, offset):
+            return np.ndarray((frames,), dtype=dtype, buffer=self._mmap,
+                              offset=offset, strides=(self.frame_length,))
+
+        magic = header_field('<u4', 0)
+        bad = np.flatnonzero(magic != constants.HDR_MAGIC)
+        if bad.size:
+            raise IOError("frame {} in {} has no valid header".format(
+                bad[0], path))
+        self.start_times = header_field('<f8', 8).copy()
+        self.end_times = header_field('<f8', 16).copy()
+
+    def __len__(self):
+        return len(self.start_times)
+
+    def __getitem__(self, index):
+        """
+        args:
+            index (int or slice): which frame(s)
+
+        returns:
+            tuple (date, body), or a list of those for a slice
+        """
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        offset = index * self.frame_length + constants.LEN_HDR
+        raw_body = np.frombuffer(self._mmap, dtype=np.uint8,
+                                 count=constants.LEN_BDY, offset=offset)
+        date = datetime.utcfromtimestamp(self.start_times[index])
+        return date, parse_body(raw_body, self.pol)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def bodies(self, start=0, stop=None):
+        """
+        The bodies of a range of frames as one strided view on the mapped
+        file, nothing is read or copied. For arthur.imaging.image_batch().
+
+        args:
+            start (int): first frame
+            stop (int): frame after the last one, the end of the file if None
+
+        returns:
+            numpy.array: FRAMES x CHANNELS x BASELINES, or FRAMES x CHANNELS
+                         x BASELINES x POLS if a tuple of polarizations is
+                         selected
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        frames = max(stop - start, 0)
+        shape = (frames, constants.NUM_BSLN, constants.NUM_CHAN,
+                 constants.NUM_POLS)
+        if not frames:
+            cube = np.empty(shape, dtype=np.complex64)
+        else:
+            itemsize = np.dtype(np.complex64).itemsize
+            strides = (self.frame_length,
+                       constants.NUM_CHAN * constants.NUM_POLS * itemsize,
+                       constants.NUM_POLS * itemsize, itemsize)
+            cube = np.ndarray(shape, dtype=np.complex64, buffer=self._mmap,
+                              offset=start * self.frame_length +
+                              constants.LEN_HDR, strides=strides)
+        return _select_pol(cube.swapaxes(1, 2), self.pol)
+
+    def time_range(self, start, end):
+        """
+        Get the frames that start within a time range.
+
+        args:
+            start (datetime.datetime): start of the range (UTC), inclusive
+            end (datetime.datetime): end of the range (UTC), exclusive
+
+        returns:
+            list: of (date, body) tuples
+        """
+        first, last = np.searchsorted(self.start_times,
+                                      [_timestamp(start), _timestamp(end)])
+        return self[first:last]
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # there are still bodies around, the map is closed with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _timestamp(date):
+    """
+    The UNIX timestamp of a naive UTC datetime, as used in the headers.
+    """
+    return calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
 
 
 @lru_cache()
@@ -129,10 +354,9 @@ def create_indices(pol, channels, baselines, pols):
         baselines (int): number of baselines
         pols (int): number of polarisations
     """
-    I = np.empty((channels, baselines), dtype=np.uint32)
-    for b in range(baselines):
-        for c in range(channels):
-            I[c, b] = pol + c * pols + b * pols * channels
+    c = np.arange(channels, dtype=np.uint32)[:, np.newaxis]
+    b = np.arange(baselines, dtype=np.uint32)[np.newaxis, :]
+    I = pol + c * pols + b * pols * channels
     return I.reshape(I.size, 1)
 
 
@@ -154,7 +378,7 @@ def reshape_body(raw_body, indices, channels, baselines):
     return result
 
 
-def listen_socket(port=5000, host='localhost'):
+def listen_socket(port=5000, host='localhost', pool=None):
     """
     Listen on socket, wait for a client to connect. Then the client is
     expected to stream raw visilibities. If the client disconnects the
@@ -163,6 +387,7 @@ def listen_socket(port=5000, host='localhost'):
     args:
         port (int): which port to listen on
         host (str): which interface to listen on
+        pool (BufferPool): receive frames into buffers from this pool
 
     returns:
         iterator
@@ -178,7 +403,148 @@ def listen_socket(port=5000, host='localhost'):
         logger.info("connection from {}:{}".format(*address))
         while True:
             try:
-                yield read_data(handler)
+                yield read_data(handler, pool)
             except IOError:
                 break
 
+
+class ConnectionStats(object):
+    """
+    Counters for one correlator connection.
+    """
+    def __init__(self, address):
+        self.address = address
+        self.bytes = 0
+        self.frames = 0
+        self.connected = True
+
+    def __repr__(self):
+        return "<ConnectionStats {}:{} bytes={} frames={}>".format(
+            self.address[0], self.address[1], self.bytes, self.frames)
+
+
+class AsyncVisServer(object):
+    """
+    An asyncio server receiving visibilities from several correlator
+    connections (subbands) at the same time. Frames are received directly
+    into BufferPool buffers and the parsed (date, body) tuples are put on a
+    bounded queue. When the queue is full the oldest frame is dropped
+    ('drop-oldest') or the connections stop reading ('backpressure').
+
+    Iterate over the server to run it in a background thread, or await
+    start() and get() from a running event loop.
+    """
+    policies = ('drop-oldest', 'backpressure')
+
+    def __init__(self, port=5000, host='localhost', maxsize=8,
+                 policy='drop-oldest', pool=None):
+        """
+        args:
+            port (int): which port to listen on, 0 picks a free one
+            host (str): which interface to listen on
+            maxsize (int): maximum number of frames waiting in the queue
+            policy (str): what to do if the queue is full, one of policies
+            pool (BufferPool): pool of receive buffers
+        """
+        if policy not in self.policies:
+            raise ValueError("unknown queue policy {}".format(policy))
+        self.port = port
+        self.host = host
+        self.maxsize = maxsize
+        self.policy = policy
+        self.pool = pool or BufferPool(size=maxsize + 2)
+        self.connections = []
+        self.dropped = 0
+        self.queue = None
+        self._socket = None
+        self._tasks = set()
+
+    async def start(self):
+        """
+        Start listening, must be called from a running event loop.
+        """
+        loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(self.maxsize)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(8)
+        self._socket.setblocking(False)
+        self.port = self._socket.getsockname()[1]
+        logger.info("waiting for connections on port {}...".format(self.port))
+        self._tasks.add(loop.create_task(self._accept()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    async def get(self):
+        """
+        returns:
+            tuple (date, body): the next received frame
+        """
+        return await self.queue.get()
+
+    async def _accept(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            handler, address = await loop.sock_accept(self._socket)
+            logger.info("connection from {}:{}".format(*address))
+            stats = ConnectionStats(address)
+            self.connections.append(stats)
+            task = loop.create_task(self._receive(handler, stats))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _receive(self, handler, stats):
+        loop = asyncio.get_event_loop()
+        length = constants.LEN_HDR + constants.LEN_BDY
+        try:
+            while True:
+                frame = self.pool.acquire(length)
+                view = memoryview(frame)
+                count = 0
+                while count < length:
+                    received = await loop.sock_recv_into(handler, view[count:])
+                    if received == 0:
+                        logger.warning("client {}:{} closed connection".format(
+                            *stats.address))
+                        return
+                    count += received
+                    stats.bytes += received
+                del view
+                start_time, end_time = parse_header(frame[:constants.LEN_HDR])
+                body = parse_body(frame[constants.LEN_HDR:])
+                stats.frames += 1
+                await self._put((datetime.utcfromtimestamp(start_time), body))
+        finally:
+            stats.connected = False
+            handler.close()
+
+    async def _put(self, frame):
+        if self.policy == 'backpressure':
+            await self.queue.put(frame)
+            return
+        while self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+    def __iter__(self):
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), loop).result()
+        try:
+            while True:
+                yield asyncio.run_coroutine_threadsafe(self.get(), loop).result()
+        finally:
+            asyncio.run_coroutine_threadsafe(self.stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
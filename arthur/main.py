@@ -1,21 +1,117 @@
 import logging
+import os
+import numpy as np
+from arthur import constants
 from arthur.writer import make_imaging_closure
-from arthur.imaging import full_calculation
-from arthur.stream import setup_stream_pipe, stream
+from arthur.calibration import load_gains
+from arthur.imaging import (full_calculation, get_fft_backend,
+                            set_fft_backend, triangle_calculation)
+from arthur.scheduler import PipelineScheduler
+from arthur.sharedmem import SharedRing
+from arthur.stream import setup_stream_pipe, stream, StreamWriter, STREAM_RES
 from concurrent.futures import ProcessPoolExecutor
 from multiprocessing import Manager
 
 
 logger = logging.getLogger(__name__)
 
+FRAME_DTYPE = np.dtype((np.complex64, (constants.NUM_CHAN, constants.NUM_BSLN)))
+INTEGRATED_DTYPE = np.dtype([
+    ('triangle', np.complex64, (constants.NUM_BSLN,)),
+    ('channels', np.complex64, (constants.NUM_CHAN,)),
+])
 
-def image_queue_pusher(date, body, frequency, queue):
+
+def result_dtype(size=constants.IMAGE_RES):
+    """
+    The dtype of a result slot, with a size x size image.
+    """
+    return np.dtype([
+        ('image', np.float32, (size, size)),
+        ('corr', np.float32, (constants.NUM_ANTS, constants.NUM_ANTS)),
+        ('chan', np.float32, (constants.NUM_CHAN,)),
+    ])
+
+
+RESULT_DTYPE = result_dtype()
+
+
+def image_frame(date, slot, frequency, frames, results, consumers=1,
+                gains=None, cell=constants.UV_CELL):
+    """
+    Do calculations on a frame. Run this in a thread or multiprocess.
+
+    The body is read from slot in the frames ring, the results are written
+    to a slot in the results ring, the image straight from the FFT. The
+    image size is that of the result slots, see result_dtype().
+
+    args:
+        gains (str): path to a gain table to calibrate with, reloaded when
+                     the file changes. See arthur.calibration.load_gains()
+        cell (float): the size of a uv cell in wavelengths
+
+    returns:
+        tuple: (date, result slot)
+    """
+    table = load_gains(gains) if gains else None
+    result_slot, result = _acquire_result(results, consumers)
+    try:
+        _, result['corr'], result['chan'] = full_calculation(
+            frames[slot], frequency, table, result['image'].shape[-1], cell,
+            out=result['image'])
+    except Exception:
+        _release_result(results, result_slot, consumers)
+        raise
+    finally:
+        del result
+        frames.release(slot)
+    return date, result_slot
+
+
+def image_integrated(date, slot, frequency, frames, results, consumers=1,
+                     cell=constants.UV_CELL):
+    """
+    Like image_frame(), for windows integrated by an
+    arthur.integration.Integrator, which are read from a ring of
+    INTEGRATED_DTYPE slots. These are already calibrated.
+
+    returns:
+        tuple: (date, result slot)
+    """
+    result_slot, result = _acquire_result(results, consumers)
+    try:
+        window = frames[slot]
+        _, result['corr'], result['chan'] = triangle_calculation(
+            window['triangle'], window['channels'], frequency,
+            result['image'].shape[-1], cell, out=result['image'])
+        del window
+    except Exception:
+        _release_result(results, result_slot, consumers)
+        raise
+    finally:
+        del result
+        frames.release(slot)
+    return date, result_slot
+
+
+def _acquire_result(results, consumers):
+    result_slot = results.acquire(consumers)
+    return result_slot, results[result_slot]
+
+
+def _release_result(results, result_slot, consumers):
+    for _ in range(consumers):
+        results.release(result_slot)
+
+
+def image_queue_pusher(date, slot, frequency, frames, results, queue,
+                       consumers=1, gains=None, cell=constants.UV_CELL):
     """
     Do calculations and put results in a queue. Run this in a thread or
-    multiprocess.
+    multiprocess. Only the result slot number goes on the queue.
     """
-    result = full_calculation(body, frequency)
-    queue.put([date] + list(result))
+    queue.put(image_frame(date, slot, frequency, frames, results, consumers,
+                          gains, cell))
 
 
 def queue_repeater(in_queue, out_queues):
@@ -35,48 +131,159 @@ def queue_repeater(in_queue, out_queues):
         logger.debug("Done repeating")
 
 
-def write_scheduler(queue, frequency, media_root):
+def write_scheduler(queue, frequency, media_root, results,
+                    cell=constants.UV_CELL):
     """
     Queue listener that will make images and write them to disk. Run in thread
     or multiprocess.
     """
-    imager_writer = make_imaging_closure(media_root, frequency)
-    while True:
-        result = queue.get()
-        logger.debug("recieved on writer queue ({})".format(queue.qsize()))
-        imager_writer(*result)
-        logger.debug("done writing")
+    size = results.dtype['image'].shape[-1]
+    imager_writer = make_imaging_closure(media_root, frequency, size=size,
+                                         cell=cell)
+    try:
+        while True:
+            date, slot = queue.get()
+            logger.debug("recieved on writer queue ({})".format(queue.qsize()))
+            result = results[slot]
+            # the writer keeps the image around to calculate the difference
+            imager_writer(date, result['image'].copy(), result['corr'],
+                          result['chan'])
+            del result
+            results.release(slot)
+            logger.debug("done writing")
+    finally:
+        imager_writer.shutdown()
 
 
-def stream_scheduler(queue, youtube_url):
+def stream_scheduler(queue, youtube_url, results, writer=None,
+                     size=STREAM_RES):
     """
     Queue listener that will stream images to youtube. Run in thread
-    or multiprocess.
+    or multiprocess. Stops when None is received.
+
+    args:
+        queue (Queue): (date, result slot) tuples
+        youtube_url (str): where to stream to, see arthur.stream.sink_args()
+        results (arthur.sharedmem.SharedRing): the result slots
+        writer (arthur.stream.StreamWriter): stream with this started writer
+                                             instead of one on a new pipe to
+                                             youtube_url
+        size (int): the width and height of the stream, images are resized
+                    to it
+
+    returns:
+        arthur.stream.StreamWriter: the writer, with its statistics
     """
-    pipe = setup_stream_pipe(youtube_url)
+    if writer is None:
+        pipe = setup_stream_pipe(youtube_url, size)
+        writer = StreamWriter(pipe, size)
+        writer.start()
     while True:
-        _, img_data, _, _ = queue.get()
+        item = queue.get()
+        if item is None:
+            return writer
+        _, slot = item
         logger.debug("Got something from stream queue ({})".format(queue.qsize()))
-        stream(img_data, pipe)
+        # the frame is serialized straight from the shared memory slot
+        stream(results[slot]['image'], writer)
+        results.release(slot)
         logger.debug("done streaming")
 
 
 def big_fat_loop_that_does_everything(generator, frequency,
-                                      media_root, youtube_url):
+                                      media_root, youtube_url,
+                                      policy='newest', max_inflight=2,
+                                      backlog=2, slots=8, gains=None,
+                                      integrator=None,
+                                      size=constants.IMAGE_RES,
+                                      cell=constants.UV_CELL,
+                                      stream_size=STREAM_RES,
+                                      fft_workers=None):
+        """
+        args:
+            generator (iterable): yields (date, body) frames
+            frequency (float): the central frequency
+            media_root (str): where to write the images
+            youtube_url (str): where to stream to
+            policy (str): what to do with frames when imaging falls behind,
+                          see arthur.scheduler.PipelineScheduler
+            max_inflight (int): maximum number of frames being imaged
+            backlog (int): maximum number of frames waiting to be imaged
+            slots (int): number of result slots in shared memory
+            gains (str): path to a gain table to calibrate with
+            integrator (arthur.integration.Integrator): image integrated
+                                                        windows instead of
+                                                        every frame
+            size (int): the size of the images
+            cell (float): the size of a uv cell in wavelengths, sets the
+                          field of view
+            stream_size (int): the width and height of the stream
+            fft_workers (int): FFT threads per imaging process, by default
+                               the cores are shared by the max_inflight
+                               frames being imaged
+        """
         manager = Manager()
         repeat_queue = manager.Queue()
         writer_queue = manager.Queue()
         stream_queue = manager.Queue()
 
-        with ProcessPoolExecutor() as executor:
-            executor.submit(queue_repeater, repeat_queue,
-                            [writer_queue, stream_queue])
-            executor.submit(write_scheduler, writer_queue,
-                            frequency, media_root)
-            executor.submit(stream_scheduler, stream_queue, youtube_url)
-            for date, body in generator:
-                logging.info("processing image timestamped {}".format(date))
-                executor.submit(image_queue_pusher, date, body,
-                                frequency, repeat_queue)
-            print("done! now what")
+        # frames and images are passed around in shared memory
+        if integrator is None:
+            frames = SharedRing(manager, FRAME_DTYPE,
+                                max_inflight + backlog + 1)
+            function, extra = image_frame, (gains, cell)
+        else:
+            frames = SharedRing(manager, INTEGRATED_DTYPE,
+                                max_inflight + backlog + 1)
+            function, extra = image_integrated, (cell,)
+        results = SharedRing(manager, result_dtype(size), slots)
+
+        def release_result(result):
+            _, slot = result
+            for _ in range(2):
+                results.release(slot)
+
+        # every pool process images with its share of the cores, instead of
+        # FFTs on all of them
+        if fft_workers is None:
+            fft_workers = max(1, (os.cpu_count() or 1) // max_inflight)
+        fft = get_fft_backend('scipy', fft_workers)
 
+        try:
+            with ProcessPoolExecutor(initializer=set_fft_backend,
+                                     initargs=(fft,)) as executor:
+                executor.submit(queue_repeater, repeat_queue,
+                                [writer_queue, stream_queue])
+                executor.submit(write_scheduler, writer_queue,
+                                frequency, media_root, results, cell)
+                executor.submit(stream_scheduler, stream_queue, youtube_url,
+                                results, None, stream_size)
+                scheduler = PipelineScheduler(
+                    executor, function, repeat_queue.put,
+                    max_inflight=max_inflight, policy=policy,
+                    backlog=backlog,
+                    on_drop=lambda date, slot, *args: frames.release(slot),
+                    on_late=release_result)
+                for date, body in generator:
+                    logging.info("processing image timestamped {}".format(date))
+                    if integrator is not None:
+                        table = load_gains(gains) if gains else None
+                        window = integrator.push(date, body, table)
+                        if window is None:
+                            continue
+                        date, triangle, channels = window
+                        slot = frames.acquire()
+                        frames[slot]['triangle'] = triangle
+                        frames[slot]['channels'] = channels
+                    else:
+                        slot = frames.acquire()
+                        frames[slot][...] = body
+                    scheduler.submit(date, slot, frequency, frames, results, 2,
+                                     *extra)
+                    logger.debug("dropped {} late {} frames".format(
+                        scheduler.dropped, scheduler.late))
+                scheduler.join()
+                print("done! now what")
+        finally:
+            frames.close()
+            results.close()
@@ -1,52 +1,23 @@
-import ephem
 import numpy as np
 from arthur import constants
+from arthur.sky import calculate_annotations, lm_axes, nan_mask
 from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
+ARROWPROPS = {'facecolor': 'white', 'width': 1, 'headwidth': 4,
+              'headlength': 5, 'shrink': 0.15, 'edgecolor': 'white'}
 
-def calculate_annotations(date):
-    """
-    Calculates the positions of a list of bodies in the sky, as seen from
-    CS002 on LOFAR and based on the datetime.
-
-    args:
-        date (datetime.datetime): For what moment to calculate positions
 
-    returns:
-        dict: name of object name, value a tuple for position.
-    """
-    obs = ephem.Observer()
-    obs.pressure = 0  # To prevent refraction corrections.
-    obs.lon, obs.lat = '6.869837540', '52.915122495'  # CS002 on LOFAR
-    obs.date = date
-    objects = [
-        ephem.Moon(),
-        ephem.Jupiter(),
-        ephem.Sun(),
-        ephem.readdb('Cas-A,f|J,23:23:26.0,58:48:00,99.00,2000'),
-        ephem.readdb('Cyg-A,f|J,19:59:28.35,40:44:02,99.00,2000'),
-        ephem.readdb('NCP,f|J, 0,90:00:00,99.00,2000'),
-        ephem.readdb('Galactic Center,f|J, 17:45:40.0,-29:00:28.1,99.00,2000'),
-    ]
-
-    annotations = {}
-    for o in objects:
-        o.compute(obs)
-        if o.alt > 0:
-            l = -(np.cos(o.alt) * np.sin(o.az))
-            m = (np.cos(o.alt) * np.cos(o.az))
-            annotations[o.name] = (l, m)
-
-    return annotations
-
-
-def plot_image(startdatetime, img_data, frequency):
+def plot_image(startdatetime, img_data, frequency, cell=constants.UV_CELL):
     """
     Plot a sky image with object overlay.
 
     args:
         date (datetime.time): start datetime of observation
-        img_data (numpy.array): a numpy array with image data
+        img_data (numpy.array): a numpy array with image data, of any size
+        cell (float): size of the uv cells in wavelengths the image was
+                      made with
 
     returns:
         matplotlib.figure.Figure
@@ -56,11 +27,8 @@ def plot_image(startdatetime, img_data, frequency):
     # fft image
     img_min = img_data.min()
     img_max = img_data.max()
-    l = np.linspace(-1, 1, constants.IMAGE_RES)
-    m = np.linspace(-1, 1, constants.IMAGE_RES)
-    mask = np.ones((constants.IMAGE_RES, constants.IMAGE_RES))
-    xv, yv = np.meshgrid(l, m)
-    mask[np.sqrt(np.array(xv ** 2 + yv ** 2)) > 1] = np.NaN
+    l, m = lm_axes(img_data.shape[0], cell)
+    mask = nan_mask(img_data.shape[0], cell)
 
     fig = plt.figure()
     ax = fig.add_subplot(1, 1, 1)
@@ -153,3 +121,165 @@ def plot_diff(diff_data, freq, date):
     plt.xticks([])
     plt.yticks([])
     return fig
+
+
+class PlotRenderer(object):
+    """
+    Renders the figures written for every frame. The figures, colorbars and
+    annotations are created once on the Agg canvas, for every frame only
+    the data, color limits, annotation positions and titles are updated.
+    """
+    names = ('image', 'lag', 'chan', 'corr', 'diff')
+
+    def __init__(self, frequency, size=constants.IMAGE_RES,
+                 cell=constants.UV_CELL):
+        """
+        args:
+            frequency (float): the frequency of the observation
+            size (int): the size of the sky images
+            cell (float): size of the uv cells in wavelengths the images are
+                          made with
+        """
+        self.frequency = frequency
+        l, m = lm_axes(size, cell)
+        self.mask = nan_mask(size, cell)
+        blank = np.zeros((size, size))
+        extent = [l[0], l[-1], m[0], m[-1]]
+
+        self.figures = {}
+        self._annotations = {'image': {}, 'diff': {}}
+
+        fig, ax = self._figure('image')
+        self._image = ax.imshow(blank, interpolation='bilinear',
+                                cmap=plt.get_cmap('jet'), extent=extent)
+        fig.colorbar(self._image)
+        ax.set_xlabel(r'$\leftarrow East - West \rightarrow$')
+        ax.set_ylabel(r'$\leftarrow South - North \rightarrow$')
+
+        fig, ax = self._figure('lag')
+        self._lag, = ax.plot([], [])
+        ax.set_title('Lag')
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('Lag (s)')
+
+        fig, ax = self._figure('chan')
+        self._chan = ax.imshow(np.zeros((constants.NUM_CHAN, 60)),
+                               interpolation='nearest',
+                               cmap=plt.get_cmap('afmhot'))
+        fig.colorbar(self._chan)
+        ax.set_title('Channel Power (dB)')
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('Channels')
+
+        fig, ax = self._figure('corr')
+        self._corr = ax.imshow(np.zeros((constants.NUM_ANTS,
+                                         constants.NUM_ANTS)),
+                               interpolation='nearest',
+                               cmap=plt.get_cmap('jet'),
+                               extent=[288, 0, 288, 0])
+        ax.set_xticks([])
+        ax.set_yticks([])
+
+        fig, ax = self._figure('diff')
+        self._diff = ax.imshow(blank, interpolation='bilinear',
+                               cmap=plt.get_cmap('coolwarm'))
+        fig.colorbar(self._diff)
+        ax.set_xlabel(r'$\leftarrow East - West \rightarrow$')
+        ax.set_ylabel(r'$\leftarrow South - North \rightarrow$')
+        ax.set_xticks([])
+        ax.set_yticks([])
+
+    def _figure(self, name):
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(1, 1, 1)
+        self.figures[name] = fig
+        return fig, ax
+
+    def _annotate(self, name, annotations):
+        """
+        Move the source annotations of a figure, hide the sources that have set.
+        """
+        ax = self.figures[name].axes[0]
+        artists = self._annotations[name]
+        for source in set(artists) - set(annotations):
+            artists[source].set_visible(False)
+        for source, pos in annotations.items():
+            text_pos = (pos[0] + 0.1, pos[1] + 0.1)
+            if source not in artists:
+                artists[source] = ax.annotate(
+                    source, xy=pos, xytext=text_pos, color='white',
+                    arrowprops=ARROWPROPS, horizontalalignment='left',
+                    verticalalignment='bottom')
+            artist = artists[source]
+            artist.xy = pos
+            artist.set_position(text_pos)
+            artist.set_visible(True)
+
+    def update_image(self, date, img_data):
+        self._image.set_data(img_data * self.mask)
+        self._image.set_clim(img_data.min(), img_data.max())
+        self._annotate('image', calculate_annotations(date))
+        self._image.axes.set_title('XX-%.2f MHz-%s' % (
+            self.frequency / 1e6, date.strftime("%Y-%m-%d_%H:%M:%S %Z")))
+        return self.figures['image']
+
+    def update_lag(self, lag_data):
+        self._lag.set_data(np.arange(len(lag_data)), lag_data)
+        self._lag.axes.relim()
+        self._lag.axes.autoscale_view()
+        return self.figures['lag']
+
+    def update_chan(self, chan_data):
+        if chan_data.shape != self._chan.get_array().shape:
+            # the history depth sets the time axis
+            rows, cols = chan_data.shape
+            self._chan.set_extent((-0.5, cols - 0.5, rows - 0.5, -0.5))
+            self._chan.axes.set_xlim(-0.5, cols - 0.5)
+            self._chan.axes.set_ylim(rows - 0.5, -0.5)
+        self._chan.set_data(chan_data)
+        if np.any(chan_data):
+            nonzero = chan_data[chan_data != 0]
+            self._chan.set_clim(nonzero.min(), nonzero.max())
+        else:
+            self._chan.set_clim(0, 0)
+        return self.figures['chan']
+
+    def update_corr(self, date, corr_data):
+        self._corr.set_data(corr_data)
+        self._corr.set_clim(corr_data.min(), corr_data.max())
+        self._corr.axes.set_title('Dipole Covariance XX-%.2f MHz-%s' % (
+            self.frequency / 1e6, date.strftime("%Y-%m-%d_%H:%M:%S %Z")))
+        return self.figures['corr']
+
+    def update_diff(self, date, diff_data):
+        self._diff.set_data(diff_data)
+        self._diff.set_clim(diff_data.min(), diff_data.max())
+        self._annotate('diff', calculate_annotations(date))
+        self._diff.axes.set_title('XX-%.2f MHz Difference-%s' % (
+            self.frequency / 1e6, date.strftime("%Y-%m-%d_%H:%M:%S %Z")))
+        return self.figures['diff']
+
+    def render(self, date, img_data, lag_data, chan_data, corr_data,
+               diff_data):
+        """
+        Update all figures for a new frame.
+
+        args:
+            date (datetime.datetime): start datetime of the frame
+            img_data (numpy.array): the sky image
+            lag_data (numpy.array): the lag history
+            chan_data (numpy.array): the channel power history
+            corr_data (numpy.array): the correlation matrix
+            diff_data (numpy.array): the difference with the previous image
+
+        returns:
+            list: (name, matplotlib.figure.Figure) tuples
+        """
+        return [
+            ('image', self.update_image(date, img_data)),
+            ('lag', self.update_lag(lag_data)),
+            ('chan', self.update_chan(chan_data)),
+            ('corr', self.update_corr(date, corr_data)),
+            ('diff', self.update_diff(date, diff_data)),
+        ]
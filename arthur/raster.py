@@ -0,0 +1,100 @@
+try:
+    from functools import lru_cache
+except ImportError:
+    from backports.functools_lru_cache import lru_cache
+
+import numpy as np
+from PIL import Image
+from arthur import constants
+from arthur.sky import horizon_mask
+
+
+@lru_cache()
+def colormap_lut(name):
+    """
+    A 256 entry lookup table for a matplotlib colormap. Matplotlib is only
+    used once to build the table.
+
+    args:
+        name (str): a matplotlib colormap name, like jet, afmhot or coolwarm
+
+    returns:
+        numpy.array: 256 x 3 uint8 RGB values
+    """
+    import matplotlib
+    cmap = matplotlib.colormaps[name]
+    lut = cmap(np.linspace(0, 1, 256), bytes=True)[:, :3]
+    lut.setflags(write=False)
+    return lut
+
+
+def colorize(data, cmap='jet', vmin=None, vmax=None, mask=None,
+             bad=(255, 255, 255)):
+    """
+    Apply a colormap to a 2d array.
+
+    args:
+        data (numpy.array): the data to colorize
+        cmap (str): a matplotlib colormap name
+        vmin (float): the value mapped to the start of the colormap,
+                      default the minimum of data
+        vmax (float): the value mapped to the end of the colormap, default
+                      the maximum of data
+        mask (numpy.array): boolean array, pixels where it is True get the
+                            bad color
+        bad (tuple): RGB color for masked pixels
+
+    returns:
+        numpy.array: rows x cols x 3 uint8 RGB image
+    """
+    vmin = np.nanmin(data) if vmin is None else vmin
+    vmax = np.nanmax(data) if vmax is None else vmax
+    # the index matplotlib picks: normalize, times 256 entries, the
+    # maximum goes in the last one
+    index = np.subtract(data, vmin, dtype=np.result_type(data, np.float32))
+    if vmax > vmin:
+        index /= vmax - vmin
+    else:
+        index.fill(0)
+    index *= 256
+    np.clip(index, 0, 255, out=index)
+    rgb = colormap_lut(cmap)[index.astype(np.uint8)]
+    if mask is not None:
+        rgb[mask] = bad
+    return rgb
+
+
+def write_png(filename, rgb, compress_level=1):
+    """
+    Encode a RGB raster to PNG with Pillow.
+
+    args:
+        filename (str): where to write the PNG to
+        rgb (numpy.array): rows x cols x 3 uint8 image
+        compress_level (int): zlib compression level, 0 (none, fastest) to
+                              9 (smallest)
+    """
+    Image.fromarray(rgb, 'RGB').save(filename, format='PNG',
+                                     compress_level=compress_level)
+
+
+def render_rasters(img_data, corr_data, diff_data, cell=constants.UV_CELL):
+    """
+    Colorize the live view products the same way arthur.plot does.
+
+    args:
+        img_data (numpy.array): the sky image
+        corr_data (numpy.array): the correlation matrix
+        diff_data (numpy.array): the difference with the previous image
+        cell (float): size of the uv cells in wavelengths the image was
+                      made with
+
+    returns:
+        list: (name, RGB image) tuples
+    """
+    return [
+        ('image', colorize(img_data, 'jet',
+                           mask=horizon_mask(img_data.shape[0], cell))),
+        ('corr', colorize(corr_data, 'jet')),
+        ('diff', colorize(diff_data, 'coolwarm')),
+    ]
@@ -0,0 +1,141 @@
+import heapq
+import itertools
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineScheduler(object):
+    """
+    Submits frames to an executor with a bounded number of frames in flight.
+
+    If all workers are busy a new frame is handled according to the policy:
+
+        block:       wait until a worker is free
+        drop-oldest: queue it, dropping the oldest queued frame when more
+                     than backlog frames are waiting
+        newest:      only keep the newest frame waiting, so the next free
+                     worker always images the most recent data
+
+    Results are passed to emit in order of their header timestamp. A result
+    older than one that was already emitted is counted as late and dropped.
+    """
+    policies = ('block', 'drop-oldest', 'newest')
+
+    def __init__(self, executor, function, emit, max_inflight=2,
+                 policy='block', backlog=2, on_drop=None, on_late=None):
+        """
+        args:
+            executor (concurrent.futures.Executor): runs the work
+            function (function): called as function(date, *args) in the
+                                 executor
+            emit (function): called with each result, in timestamp order
+            max_inflight (int): maximum number of frames being processed
+            policy (str): one of policies
+            backlog (int): maximum number of waiting frames for drop-oldest
+            on_drop (function): called as on_drop(date, *args) for every
+                                frame that is dropped, for example to
+                                release its buffer
+            on_late (function): called with every result that is dropped
+                                because it is late
+        """
+        if policy not in self.policies:
+            raise ValueError("unknown scheduling policy {}".format(policy))
+        self.executor = executor
+        self.function = function
+        self.emit = emit
+        self.max_inflight = max_inflight
+        self.policy = policy
+        self.backlog = 1 if policy == 'newest' else backlog
+        self.on_drop = on_drop
+        self.on_late = on_late
+
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.late = 0
+        self.failed = 0
+
+        self._pending = deque()
+        self._inflight = {}
+        self._results = []
+        self._counter = itertools.count()
+        self._last = None
+        self._condition = threading.Condition(threading.RLock())
+
+    def submit(self, date, *args):
+        """
+        Schedule a frame.
+
+        args:
+            date (datetime.datetime): the header timestamp of the frame
+            args: passed on to function
+        """
+        with self._condition:
+            if self.policy == 'block':
+                while len(self._inflight) >= self.max_inflight:
+                    self._condition.wait()
+            self._pending.append((date, args))
+            self._start()
+            while len(self._pending) > self.backlog:
+                dropped_date, dropped_args = self._pending.popleft()
+                self.dropped += 1
+                logger.warning("dropping frame timestamped {}".format(
+                    dropped_date))
+                if self.on_drop:
+                    self.on_drop(dropped_date, *dropped_args)
+
+    def join(self):
+        """
+        Wait until all scheduled frames are processed and emitted.
+        """
+        with self._condition:
+            while self._pending or self._inflight:
+                self._condition.wait()
+            self._emit_ready()
+
+    def _start(self):
+        while self._pending and len(self._inflight) < self.max_inflight:
+            date, args = self._pending.popleft()
+            future = self.executor.submit(self.function, date, *args)
+            self._inflight[future] = date
+            self.submitted += 1
+            future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        with self._condition:
+            date = self._inflight.pop(future)
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception("processing frame {} failed".format(date))
+                self.failed += 1
+            else:
+                self.completed += 1
+                heapq.heappush(self._results,
+                               (date, next(self._counter), result))
+            self._start()
+            self._emit_ready()
+            self._condition.notify_all()
+
+    def _emit_ready(self):
+        """
+        Emit the results that no frame still being processed should precede.
+        """
+        outstanding = list(self._inflight.values())
+        outstanding += [date for date, _ in self._pending]
+        horizon = min(outstanding) if outstanding else None
+        while self._results and (horizon is None or
+                                 self._results[0][0] < horizon):
+            date, _, result = heapq.heappop(self._results)
+            if self._last is not None and date < self._last:
+                self.late += 1
+                logger.warning("dropping late frame timestamped {}".format(
+                    date))
+                if self.on_late:
+                    self.on_late(result)
+                continue
+            self._last = date
+            self.emit(result)
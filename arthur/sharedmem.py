@@ -0,0 +1,107 @@
+import logging
+from multiprocessing import shared_memory
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SharedRing(object):
+    """
+    A ring of equally typed numpy arrays in shared memory. Free slots are
+    handed out through a manager queue, so only slot numbers travel between
+    processes, never the data itself.
+
+    A slot can be acquired for several consumers; it goes back into the
+    ring once all of them have released it. The ring can be pickled and is
+    attached to the shared memory again in the receiving process.
+    """
+    def __init__(self, manager, dtype, slots):
+        """
+        args:
+            manager (multiprocessing.managers.SyncManager): used for the free
+                                                            slot queue and
+                                                            the lock
+            dtype (numpy.dtype): the type of one slot, for example a sub
+                                 array type like ('f4', (256, 256)) or a
+                                 structured type
+            slots (int): number of slots in the ring
+        """
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self._offset = _align(slots * np.dtype(np.int32).itemsize)
+        size = self._offset + slots * self.dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self._shm.name
+        self._owner = True
+        self._free = manager.Queue()
+        self._lock = manager.Lock()
+        self._attach()
+        self._refs[:] = 0
+        for slot in range(slots):
+            self._free.put(slot)
+
+    def _attach(self):
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        self._refs = np.ndarray((self.slots,), dtype=np.int32,
+                                buffer=self._shm.buf)
+        self._arrays = np.ndarray((self.slots,), dtype=self.dtype,
+                                  buffer=self._shm.buf, offset=self._offset)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_shm', '_refs', '_arrays'):
+            del state[key]
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+        self._attach()
+
+    def __getitem__(self, slot):
+        """
+        returns:
+            numpy.array: the data of a slot, a view on the shared memory
+        """
+        return self._arrays[slot]
+
+    def acquire(self, consumers=1):
+        """
+        Get a free slot, blocks until one is available.
+
+        args:
+            consumers (int): how many times the slot has to be released
+                             before it is free again
+
+        returns:
+            int: the slot number
+        """
+        slot = self._free.get()
+        self._refs[slot] = consumers
+        return slot
+
+    def release(self, slot):
+        """
+        Release a slot, it is free again after the last consumer released it.
+        """
+        with self._lock:
+            self._refs[slot] -= 1
+            free = self._refs[slot] <= 0
+        if free:
+            self._free.put(slot)
+
+    def close(self):
+        """
+        Detach from the shared memory, and remove it if this is the process
+        that created the ring.
+        """
+        del self._refs, self._arrays
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _align(offset, alignment=64):
+    return -(-offset // alignment) * alignment
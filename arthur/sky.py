@@ -0,0 +1,139 @@
+try:
+    from functools import lru_cache
+except ImportError:
+    from backports.functools_lru_cache import lru_cache
+
+import calendar
+import threading
+from datetime import datetime
+import ephem
+import numpy as np
+from arthur import constants
+
+# annotations are calculated once per bucket of this many seconds, the
+# sources move less than a pixel in that time.
+ANNOTATION_BUCKET = 10
+
+_lock = threading.Lock()
+_observer = None
+_catalog = None
+
+
+@lru_cache()
+def lm_axes(size, cell=constants.UV_CELL):
+    """
+    args:
+        size (int): size of the sky image
+        cell (float): size of the uv cells in wavelengths the image was
+                      made with, 0.5 for the whole sky
+
+    returns:
+        tuple: (l, m) direction cosines of the pixel centers
+    """
+    l = np.linspace(-1, 1, size) / (2 * cell)
+    m = np.linspace(-1, 1, size) / (2 * cell)
+    l.setflags(write=False)
+    m.setflags(write=False)
+    return l, m
+
+
+@lru_cache()
+def horizon_mask(size, cell=constants.UV_CELL):
+    """
+    args:
+        size (int): size of the sky image
+        cell (float): size of the uv cells in wavelengths
+
+    returns:
+        numpy.array: boolean size x size array, True below the horizon
+    """
+    l, m = lm_axes(size, cell)
+    xv, yv = np.meshgrid(l, m)
+    mask = np.sqrt(xv ** 2 + yv ** 2) > 1
+    mask.setflags(write=False)
+    return mask
+
+
+@lru_cache()
+def nan_mask(size, cell=constants.UV_CELL):
+    """
+    args:
+        size (int): size of the sky image
+        cell (float): size of the uv cells in wavelengths
+
+    returns:
+        numpy.array: size x size array, 1 above and NaN below the horizon,
+                     for multiplying with an image
+    """
+    mask = np.ones((size, size))
+    mask[horizon_mask(size, cell)] = np.nan
+    mask.setflags(write=False)
+    return mask
+
+
+def observer():
+    """
+    returns:
+        ephem.Observer: the (shared) observer at CS002 on LOFAR
+    """
+    global _observer
+    if _observer is None:
+        obs = ephem.Observer()
+        obs.pressure = 0  # To prevent refraction corrections.
+        obs.lon, obs.lat = '6.869837540', '52.915122495'  # CS002 on LOFAR
+        _observer = obs
+    return _observer
+
+
+def catalog():
+    """
+    returns:
+        list: the (shared) ephem bodies to annotate
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = [
+            ephem.Moon(),
+            ephem.Jupiter(),
+            ephem.Sun(),
+            ephem.readdb('Cas-A,f|J,23:23:26.0,58:48:00,99.00,2000'),
+            ephem.readdb('Cyg-A,f|J,19:59:28.35,40:44:02,99.00,2000'),
+            ephem.readdb('NCP,f|J, 0,90:00:00,99.00,2000'),
+            ephem.readdb('Galactic Center,f|J, 17:45:40.0,-29:00:28.1,99.00,2000'),
+        ]
+    return _catalog
+
+
+def calculate_annotations(date, bucket=ANNOTATION_BUCKET):
+    """
+    Calculates the positions of a list of bodies in the sky, as seen from
+    CS002 on LOFAR and based on the datetime. The result is cached per time
+    bucket, the returned dict is shared and should not be modified.
+
+    args:
+        date (datetime.datetime): For what moment to calculate positions
+        bucket (float): round date to a multiple of this many seconds, 0
+                        to calculate for the exact moment
+
+    returns:
+        dict: name of object name, value a tuple for position.
+    """
+    timestamp = calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
+    if bucket:
+        timestamp = round(timestamp / bucket) * bucket
+    return _annotations(timestamp)
+
+
+@lru_cache(maxsize=16)
+def _annotations(timestamp):
+    with _lock:
+        obs = observer()
+        obs.date = datetime.utcfromtimestamp(timestamp)
+        annotations = {}
+        for o in catalog():
+            o.compute(obs)
+            if o.alt > 0:
+                l = -(np.cos(o.alt) * np.sin(o.az))
+                m = (np.cos(o.alt) * np.cos(o.az))
+                annotations[o.name] = (l, m)
+    return annotations
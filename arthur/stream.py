@@ -1,76 +1,175 @@
 import os
 from casacore.images import image as casa_image
-from PIL import Image
 import subprocess
-import time
+import threading
 import monotonic
 import logging
 import atexit
+from collections import OrderedDict
+import numpy as np
+
+try:
+    from functools import lru_cache
+except ImportError:
+    from backports.functools_lru_cache import lru_cache
 
 logger = logging.getLogger(__name__)
 
-FPS = 25
+FPS = 25         # the output framerate of the stream
+INPUT_RATE = 1   # how many frames per second are fed to ffmpeg
+STREAM_RES = 1024  # the width and height of the stream
+
+
+def make_cmd(size=STREAM_RES, input_rate=INPUT_RATE, fps=FPS,
+             preset='ultrafast', threads=6, bufsize='512k'):
+    """
+    Build the ffmpeg command line. ffmpeg reads frames at the input rate and
+    duplicates them itself to reach the output framerate.
+
+    args:
+        size (int): width and height of the frames written to ffmpeg
+        input_rate (float): frames per second written to ffmpeg
+        fps (int): the output framerate
+        preset (str): the x264 encoding quality preset
+        threads (int): number of encoder threads
+        bufsize (str): the rate control buffer size
+
+    returns:
+        list: the command, without the output, see sink_args()
+    """
+    return ["ffmpeg",
+            # for ffmpeg always first set input then output
+
+            # silent audio
+            '-f', 'lavfi',
+            '-i', 'anullsrc=channel_layout=stereo:sample_rate=44100',
+
+            # image
+            '-f', 'rawvideo',           # probably required for reading from stdin
+            '-s', '{0}x{0}'.format(size),  # should match the serialized frames
+            '-pix_fmt', 'gray',
+            '-framerate', str(input_rate),  # the rate we write frames with
+            '-probesize', '32',         # the format is known, don't wait for
+            '-analyzeduration', '0',    # several frames to probe it
+            '-i', '-',                  # read from stdin
 
-cmd = ["ffmpeg",
-       # for ffmpeg always first set input then output
+            # encoding settings
+            "-vf", "fps={}".format(fps),  # duplicate frames up to the framerate
+            "-r", str(fps),             # the framerate
+            "-vcodec", "libx264",       # probably required for flv & rtmp
+            "-preset", preset,          # the encoding quality preset
+            "-g", "20",
+            "-codec:a", "libmp3lame",   # mp3 for audio
+            "-ar", "44100",             # 44k audio rate
+            "-threads", str(threads),
+            "-bufsize", bufsize,
+            "-shortest",                # stop with the video, audio is endless
+            ]
 
-       # silent audio
-       '-f', 'lavfi',
-       '-i', 'anullsrc=channel_layout=stereo:sample_rate=44100',
 
-       # image
-       '-re',
-       '-f', 'rawvideo',           # probably required for reading from stdin
-       '-s', '1024x1024',          # should match image size
-       '-pix_fmt', 'gray',
-       '-i', '-',                  # read from stdin
+def sink_args(sink):
+    """
+    The ffmpeg output arguments for a sink.
+
+    args:
+        sink (str): where to send the stream to, one of:
+                    - a rtmp:// or rtmps:// url, streamed as flv
+                    - a tcp://host:port url, streamed as flv. Append
+                      ?listen=1 to let ffmpeg wait for a player to connect
+                    - 'null', encode but throw the result away
+                    - a filename, the container is guessed from the extension
+
+    returns:
+        list: ffmpeg output arguments
+    """
+    if sink == 'null':
+        return ['-f', 'null', os.devnull]
+    if sink.startswith(('rtmp://', 'rtmps://', 'tcp://')):
+        return ['-f', 'flv', sink]     # flv is required for rtmp
+    return ['-y', sink]
 
-       # encoding settings
-       "-r", str(FPS),             # the framerate
-       "-vcodec", "libx264",       # probably required for flv & rtmp
-       "-preset", "ultrafast",     # the encoding quality preset
-       "-g", "20",
-       "-codec:a", "libmp3lame",   # mp3 for audio
-       "-ar", "44100",             # 44k audio rate
-       "-threads", "6",
-       "-bufsize", "512k",
-       "-f", "flv",                # required for rtmp
-       ]
 
+cmd = make_cmd()
 
-def setup_stream_pipe(rtmp_url):
+
+def setup_stream_pipe(sink, size=STREAM_RES, input_rate=INPUT_RATE,
+                      progress=False, **encoding):
     """
     Setup a encoding process where you can pipe images to.
 
     args:
-        rtmp_url (str): a rtmp url, for example rtmp://a.rtmp.youtube.com/live2/{SECRET}
+        sink (str): where to stream to, for example a rtmp url like
+                    rtmp://a.rtmp.youtube.com/live2/{SECRET}, see sink_args()
+        size (int): width and height of the frames written to the pipe
+        input_rate (float): frames per second written to the pipe
+        progress (bool): let ffmpeg write key=value progress reports to
+                         pipe.stdout
+        encoding: extra encoder settings passed on to make_cmd()
 
     returns:
         subprocess.Popen: a subprocess pipe. Use pipe.stdin.write for writing images.
     """
-    pipe = subprocess.Popen(cmd + [rtmp_url], stdin=subprocess.PIPE)
+    command = make_cmd(size, input_rate, **encoding)
+    stdout = None
+    if progress:
+        command[1:1] = ['-nostats', '-progress', 'pipe:1']
+        stdout = subprocess.PIPE
+    pipe = subprocess.Popen(command + sink_args(sink),
+                            stdin=subprocess.PIPE, stdout=stdout)
     atexit.register(pipe.kill)
     return pipe
 
 
-def serialize_array(array):
+def serialize_array(array, size=None, out=None, scratch=None):
     """
-    serialize a numpy array into a binary stream which can be streamed
+    serialize a numpy array into a gray scale frame which can be streamed.
+    The array is normalised to 0-255 and resized with nearest neighbour
+    sampling, the array itself is not modified.
 
     args:
-        array (numpy.array)
+        array (numpy.array): a 2D image, may have extra length 1 axes
+        size (int): width and height of the frame, defaults to the image size
+        out (numpy.array): size x size uint8 array to write the frame into
+        scratch (numpy.array): float32 array shaped like the image, used for
+                               the normalisation
 
     returns:
-        bytes
+        numpy.array: size x size uint8 frame, supports the buffer protocol
     """
     data = array.squeeze()
-    data -= data.min()
+    rows, cols = data.shape
+    if size is None:
+        size = rows
+    if out is None:
+        out = np.empty((size, size), dtype=np.uint8)
+    if scratch is None:
+        scratch = np.empty(data.shape, dtype=np.float32)
+
+    min_ = data.min()
     max_ = data.max()
-    if max_ > 0:
-        data *= (255 / data.max())
-    arr = data.astype('uint8')
-    im = Image.fromarray(arr, 'L')
-    return im.tobytes()
+    np.subtract(data, min_, out=scratch, casting='unsafe')
+    if max_ > min_:
+        np.multiply(scratch, 255 / (max_ - min_), out=scratch)
+        np.rint(scratch, out=scratch)  # the maximum may end up at 254.99
+
+    if (rows, cols) == (size, size):
+        np.copyto(out, scratch, casting='unsafe')
+    elif size % rows == 0 and size % cols == 0:
+        # integer upscaling, broadcast every pixel into a block of the frame
+        blocks = out.reshape(rows, size // rows, cols, size // cols)
+        np.copyto(blocks, scratch[:, None, :, None], casting='unsafe')
+    else:
+        row_index, col_index = _resize_index(rows, cols, size)
+        np.copyto(out, scratch[row_index, col_index], casting='unsafe')
+    return out
+
+
+@lru_cache(maxsize=4)
+def _resize_index(rows, cols, size):
+    """ nearest neighbour source indices for resizing to size x size """
+    row_index = (np.arange(size) * rows // size)[:, None]
+    col_index = (np.arange(size) * cols // size)[None, :]
+    return row_index, col_index
 
 
 def loop_images_in_path(path):
@@ -87,21 +186,192 @@ def loop_images_in_path(path):
             yield casa_image(image_path).getdata()
 
 
-def stream(frame, pipe):
+class ImageLoop(object):
     """
-    stream the images returned by generated to rtmp server.
+    Endlessly loops over a folder of casacore images as serialized stream
+    frames. A background thread reads the next images ahead of time, so
+    reading overlaps with encoding. Frames are kept in a bounded LRU cache,
+    if it holds the whole folder the images are only read once.
+    """
+    def __init__(self, path, size=STREAM_RES, cache=64, prefetch=2):
+        """
+        args:
+            path (str): path to folder containing images
+            size (int): width and height of the frames
+            cache (int): maximum number of frames kept in memory
+            prefetch (int): how many images to read ahead
+        """
+        self.paths = sorted([os.path.join(path, i) for i in os.listdir(path)])
+        if not self.paths:
+            raise IOError("no images in {}".format(path))
+        self.size = size
+        self.cache = max(cache, prefetch + 1)
+        self.prefetch = prefetch
+        self.reads = 0   # images read from disk
+        self._frames = OrderedDict()
+        self._position = 0
+        self._error = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._prefetcher,
+                                        name='image-loop', daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        while True:
+            for index in range(len(self.paths)):
+                yield self[index]
+
+    def __getitem__(self, index):
+        """
+        returns:
+            numpy.array: size x size uint8 frame of image index, don't modify
+        """
+        with self._condition:
+            self._position = index
+            self._condition.notify_all()
+            while index not in self._frames:
+                if self._error:
+                    raise self._error
+                self._condition.wait()
+            self._frames.move_to_end(index)
+            return self._frames[index]
+
+    def _wanted(self):
+        """ the first image in the prefetch window which is not cached """
+        for offset in range(self.prefetch + 1):
+            index = (self._position + offset) % len(self.paths)
+            if index not in self._frames:
+                return index
+
+    def _prefetcher(self):
+        while True:
+            with self._condition:
+                index = self._wanted()
+                while index is None and not self._closed:
+                    self._condition.wait()
+                    index = self._wanted()
+                if self._closed:
+                    return
+            try:
+                data = casa_image(self.paths[index]).getdata()
+                frame = serialize_array(data, self.size)
+            except Exception as e:
+                logger.error("can't read {}: {}".format(self.paths[index], e))
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._frames[index] = frame
+                self.reads += 1
+                while len(self._frames) > self.cache:
+                    self._frames.popitem(last=False)
+                self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+
+class StreamWriter(threading.Thread):
+    """
+    Feeds frames to the encoder at a fixed input rate in a background
+    thread. The newest frame is written every tick, the previous frame is
+    repeated if nothing new arrived, so producers never wait for the encoder.
+
+    Frames are triple buffered: the producer serializes into a back buffer,
+    which is swapped with the ready buffer. The thread swaps the ready buffer
+    with the one it writes.
+    """
+    def __init__(self, pipe, size=STREAM_RES, input_rate=INPUT_RATE):
+        """
+        args:
+            pipe (subprocess.Popen): a pipe created with setup_stream_pipe()
+            size (int): width and height of the frames
+            input_rate (float): frames per second written to the pipe
+        """
+        super(StreamWriter, self).__init__(name='stream-writer', daemon=True)
+        self.pipe = pipe
+        self.size = size
+        self.interval = 1.0 / input_rate
+        self.frames = 0    # frames written to the encoder
+        self.repeats = 0   # ticks on which the previous frame was repeated
+        self.stalls = 0    # writes that took longer than a tick
+        self._buffers = [np.zeros((size, size), dtype=np.uint8)
+                         for _ in range(3)]
+        self._scratch = None
+        self._fresh = False
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+
+    def update(self, frame):
+        """
+        Serialize a new frame, it will be written on the next tick. Does not
+        modify or keep a reference to the frame. Already serialized frames,
+        for example from ImageLoop, are copied as is.
+
+        args:
+            frame (numpy.array): an image frame
+        """
+        data = frame.squeeze()
+        back = self._buffers[2]
+        if data.dtype == np.uint8 and data.shape == back.shape:
+            np.copyto(back, data)
+        else:
+            if self._scratch is None or self._scratch.shape != data.shape:
+                self._scratch = np.empty(data.shape, dtype=np.float32)
+            serialize_array(data, self.size, out=back, scratch=self._scratch)
+        with self._lock:
+            self._buffers[1], self._buffers[2] = back, self._buffers[1]
+            self._fresh = True
+
+    def run(self):
+        next_tick = monotonic.monotonic()
+        while not self._halt.is_set():
+            with self._lock:
+                if self._fresh:
+                    self._buffers[0], self._buffers[1] = \
+                        self._buffers[1], self._buffers[0]
+                    self._fresh = False
+                elif self.frames:
+                    self.repeats += 1
+            try:
+                self.pipe.stdin.write(self._buffers[0])
+                self.pipe.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                logger.error("looks like the video encoder died!")
+                return
+            self.frames += 1
+
+            next_tick += self.interval
+            delay = next_tick - monotonic.monotonic()
+            if delay < 0:
+                self.stalls += 1
+                next_tick = monotonic.monotonic()
+            else:
+                self._halt.wait(delay)
+
+    def stop(self):
+        self._halt.set()
+
+
+def stream(frame, writer):
+    """
+    stream an image to the rtmp server, returns immediately.
 
     args:
         frame: an image frame
-        pipe (subprocess.Popen): a pipe created with setup_stream_pipe()
+        writer (StreamWriter): a started writer on a pipe created with
+                               setup_stream_pipe()
     """
     logger.debug("streaming new image")
-    serialised = serialize_array(frame)
-    for i in range(FPS):
-        pipe.stdin.write(serialised)
-    duty_cycle = 1  # seconds
-
-    if pipe.poll():
-        print("looks like the video encoder died!")
+    if writer.pipe.poll() is not None:
+        logger.error("looks like the video encoder died!")
         return
-    time.sleep(duty_cycle - monotonic.monotonic() % duty_cycle)
+    writer.update(frame)
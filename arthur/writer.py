@@ -1,19 +1,27 @@
 import logging
+import os
 from os import path, symlink, unlink
-import numpy as np
 import time
+from concurrent.futures import ProcessPoolExecutor
 from arthur.imaging import  calculate_lag
-from arthur.plot import plot_image, plot_lag, plot_chan_power, plot_corr_mat, plot_diff
-from arthur.constants import NUM_CHAN
+from arthur.plot import plot_image, plot_lag, plot_chan_power, plot_corr_mat, plot_diff, PlotRenderer
+from arthur.constants import IMAGE_RES, NUM_CHAN, UV_CELL
+from arthur.history import History
+from arthur.raster import render_rasters, write_png
 from matplotlib import pyplot as plt
 
 filename_template = "S{band}_R01-63_{timestamp}_{figure}.png"
 
 logger = logging.getLogger(__name__)
 
+# the figure renderers of a render pool worker process, per frequency, image
+# size and uv cell
+_renderers = {}
+
 
 def write_images_to_disk(date, img_data, corr_data, lags, prev_data,
-                         chan_data, chan_row, frequency, prefix):
+                         chan_data, chan_row, frequency, prefix,
+                         renderer=None, pool=None, cell=UV_CELL):
     """
     Calculate and write various images to disk.
 
@@ -23,53 +31,173 @@ def write_images_to_disk(date, img_data, corr_data, lags, prev_data,
         date (datetime.datetime)
         img_data (numpy.array): the image data
         corr_data (numpy.array): the correlation data
-        lags (numpy.array): history of difference between header timestamp and
-                            arrival
+        lags (arthur.history.History): history of difference between header
+                                       timestamp and arrival, will be
+                                       updated
         prev_data (numpy.array): the previous image, used for calculate diff
-        chan_data (numpy.array): the historical chan data, will be
-                                 updated using chan_row
+        chan_data (arthur.history.History): the historical chan data, will be
+                                            updated using chan_row
         chan_row (numpy.array): the new chan array
         frequency (float): the frequency of the observation
         prefix (str): where to write the images to
+        renderer (arthur.plot.PlotRenderer): reuse the figures of this
+                                             renderer instead of creating
+                                             new ones
+        pool (concurrent.futures.Executor): render the figures in parallel
+                                            in this pool
+        cell (float): size of the uv cells in wavelengths the image was made
+                      with
     """
-    lags += [calculate_lag(date).seconds]
+    lags.push(calculate_lag(date).seconds)
     if prev_data is None:
         prev_data = img_data
 
-        # update historical data
-    chan_data = np.roll(chan_data, 1)
-    chan_data[:, 0] = chan_row
+    # update historical data
+    chan_data.push(chan_row)
     diff_data = img_data - prev_data
     prev_data = img_data
 
-    figures = (
-        ('image', plot_image(date, img_data, frequency)),
-        ('lag', plot_lag(lags)),
-        ('chan', plot_chan_power(chan_data)),
-        ('corr', plot_corr_mat(corr_data, frequency, date)),
-        ('diff', plot_diff(diff_data, frequency, date)),
-    )
+    if pool:
+        products = (
+            ('image', (date, img_data)),
+            ('lag', (lags.view(),)),
+            ('chan', (chan_data.view(full=True)[::-1].T,)),
+            ('corr', (date, corr_data)),
+            ('diff', (date, diff_data)),
+        )
+        futures = []
+        for name, args in products:
+            filename = make_filename(date, frequency, name)
+            logger.info('writing {}'.format(filename))
+            futures.append((name, pool.submit(render_product, name, prefix,
+                                              filename, frequency, args,
+                                              img_data.shape[0], cell)))
+        for name, future in futures:
+            link_latest(prefix, name, future.result())
+        return
+
+    if renderer:
+        figures = renderer.render(date, img_data, lags.view(),
+                                  chan_data.view(full=True)[::-1].T,
+                                  corr_data, diff_data)
+    else:
+        figures = (
+            ('image', plot_image(date, img_data, frequency, cell)),
+            ('lag', plot_lag(lags.view())),
+            ('chan', plot_chan_power(chan_data.view(full=True)[::-1].T)),
+            ('corr', plot_corr_mat(corr_data, frequency, date)),
+            ('diff', plot_diff(diff_data, frequency, date)),
+        )
 
-    timestamp = date.strftime("T%d-%m-%Y-%H-%M-%S%Z")
-    some_constant = 195312.5  # not sure what this is, ask Folkert
     for name, figure in figures:
-        args = {'band': int(frequency / some_constant),
-                'timestamp': timestamp,
-                'figure': name}
-        filename = filename_template.format(**args)
-        full_filename = path.join(prefix, filename)
+        filename = make_filename(date, frequency, name)
+        logger.info('writing {}'.format(filename))
+        atomic_write(path.join(prefix, filename),
+                     lambda tmp: figure.savefig(tmp, format='png'))  # pad_inches=0, bbox_inches='tight')
+        if not renderer:
+            plt.close(figure)  # required to free up memory
+        link_latest(prefix, name, filename)
+
+
+def write_rasters_to_disk(date, img_data, corr_data, diff_data, frequency,
+                          prefix, compress_level=1, cell=UV_CELL):
+    """
+    Write the sky image, correlation matrix and difference image as plain
+    colormapped rasters, without matplotlib. Intended for the live view.
+
+    args:
+        date (datetime.datetime)
+        img_data (numpy.array): the image data
+        corr_data (numpy.array): the correlation data
+        diff_data (numpy.array): the difference with the previous image
+        frequency (float): the frequency of the observation
+        prefix (str): where to write the images to
+        compress_level (int): PNG compression level, 0 to 9
+        cell (float): size of the uv cells in wavelengths the image was made
+                      with
+    """
+    for name, rgb in render_rasters(img_data, corr_data, diff_data, cell):
+        filename = make_filename(date, frequency, name)
         logger.info('writing {}'.format(filename))
-        figure.savefig(full_filename)  # pad_inches=0, bbox_inches='tight')
-        plt.close(figure)  # required to free up memory
+        atomic_write(path.join(prefix, filename),
+                     lambda tmp: write_png(tmp, rgb, compress_level))
+        link_latest(prefix, name, filename)
+
+
+def render_product(name, prefix, filename, frequency, args, size=IMAGE_RES,
+                   cell=UV_CELL):
+    """
+    Render and write one figure with the persistent renderer of the current
+    process. This runs in a worker of the render pool.
+
+    args:
+        name (str): which figure, one of arthur.plot.PlotRenderer.names
+        prefix (str): where to write the image to
+        filename (str): the filename of the image
+        frequency (float): the frequency of the observation
+        args (tuple): passed on to PlotRenderer.update_<name>()
+        size (int): the size of the sky images
+        cell (float): size of the uv cells in wavelengths the images are
+                      made with
+
+    returns:
+        str: the filename
+    """
+    key = (frequency, size, cell)
+    renderer = _renderers.get(key)
+    if renderer is None:
+        renderer = _renderers[key] = PlotRenderer(frequency, size, cell)
+    figure = getattr(renderer, 'update_' + name)(*args)
+    atomic_write(path.join(prefix, filename),
+                 lambda tmp: figure.savefig(tmp, format='png'))
+    return filename
+
+
+def atomic_write(filename, write):
+    """
+    Write a file under a temporary name in the same folder and rename it
+    into place, so readers never see a partially written file.
+
+    args:
+        filename (str): the file to write
+        write (function): called with the temporary filename to write to
+    """
+    folder, base = path.split(filename)
+    tmp = path.join(folder, '.{}.{}.tmp'.format(base, os.getpid()))
+    try:
+        write(tmp)
+        os.replace(tmp, filename)
+    except BaseException:
+        if path.lexists(tmp):
+            unlink(tmp)
+        raise
 
-        # symlink to latest version
-        link_target = path.join(prefix, name + '.png')
-        if path.islink(link_target):
-            unlink(link_target)
-        symlink(filename, link_target)
+
+def make_filename(date, frequency, name):
+    timestamp = date.strftime("T%d-%m-%Y-%H-%M-%S%Z")
+    some_constant = 195312.5  # not sure what this is, ask Folkert
+    args = {'band': int(frequency / some_constant),
+            'timestamp': timestamp,
+            'figure': name}
+    return filename_template.format(**args)
+
+
+def link_latest(prefix, name, filename):
+    """
+    symlink name.png in prefix to the latest version. The new link is
+    renamed over the old one, so the link never disappears.
+    """
+    link_target = path.join(prefix, name + '.png')
+    tmp = path.join(prefix, '.{}.png.{}.tmp'.format(name, os.getpid()))
+    if path.lexists(tmp):
+        unlink(tmp)
+    symlink(filename, tmp)
+    os.replace(tmp, link_target)
 
 
-def make_imaging_closure(prefix, frequency):
+def make_imaging_closure(prefix, frequency, depth=60, fast=False,
+                         compress_level=1, workers=None, size=IMAGE_RES,
+                         cell=UV_CELL):
     """
     iterate over iterable containing visibilities, makes images and writes them
     into prefix:
@@ -78,14 +206,35 @@ def make_imaging_closure(prefix, frequency):
         iterable (iterable): an iterable of generators generating visibilites
         prefix (str): a filesystem prefix where to write the images to
         frequency (float): the central frequency
+        depth (int): how many frames of lag and channel history to plot
+        fast (bool): only write the image, correlation and difference as
+                     plain rasters for the live view, see
+                     write_rasters_to_disk()
+        compress_level (int): PNG compression level of the fast rasters
+        workers (int): number of processes rendering figures in parallel,
+                       by default one per figure up to the number of cores.
+                       Render in the calling process if 1 or less.
+        size (int): the size of the sky images
+        cell (float): size of the uv cells in wavelengths the images are
+                      made with
 
     return:
-
+        function: call it with (date, image, correlation matrix, channel
+                  row) for every frame. Call its shutdown() when done, to
+                  stop the render processes.
     """
     # initialise historical structures
-    lags = []
+    lags = History(depth)
     prev_data = None
-    chan_data = np.zeros((NUM_CHAN, 60), dtype=np.float32)
+    chan_data = History(depth, shape=(NUM_CHAN,))
+    renderer = pool = None
+    if not fast:
+        if workers is None:
+            workers = min(len(PlotRenderer.names), os.cpu_count() or 1)
+        if workers > 1:
+            pool = ProcessPoolExecutor(workers)
+        else:
+            renderer = PlotRenderer(frequency, size, cell)
 
     # we create a closure here so we can store state (
     def closure(date, img_data, corr_data, chan_row):
@@ -98,7 +247,22 @@ def make_imaging_closure(prefix, frequency):
 
         """
         nonlocal prev_data
+        if fast:
+            previous = img_data if prev_data is None else prev_data
+            write_rasters_to_disk(date, img_data, corr_data,
+                                  img_data - previous, frequency, prefix,
+                                  compress_level, cell)
+            prev_data = img_data
+            return
         write_images_to_disk(date, img_data, corr_data, lags, prev_data,
-                             chan_data, chan_row, frequency, prefix)
+                             chan_data, chan_row, frequency, prefix, renderer,
+                             pool, cell)
         prev_data = img_data
+
+    def shutdown():
+        """ stop the render processes, if any """
+        if pool is not None:
+            pool.shutdown()
+
+    closure.shutdown = shutdown
     return closure
@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 
 import logging
-from arthur.io import listen_socket
+from arthur.io import AsyncVisServer
 
 
 def main():
     logging.basicConfig(level=logging.INFO)
-    for date, mat in listen_socket():
-        print(date)
+    server = AsyncVisServer()
+    for date, mat in server:
+        print(date, server.connections, "dropped: {}".format(server.dropped))
 
 if __name__ == '__main__':
     main()
@@ -5,15 +5,25 @@ from arthur.io import read_full
 import numpy as np
 from arthur import constants
 from arthur.data import load_antpos
-from arthur.imaging import correlation_matrix
+from arthur.imaging import (FFT_BACKENDS, correlation_matrix, make_image,
+                            set_fft_backend)
 
-from arthur.gridding_fast import grid as grid_fast
-from arthur.gridding import grid
+from arthur.gridding import available_backends, get_backend, gridding_plan
 import time
 
 FRQ = 58398437.5  # Central observation frequency in Hz
 
 
+def timeit(function, *args):
+    durations = []
+    for i in range(5):
+        start = time.time()
+        function(*args)
+        end = time.time()
+        durations.append(end-start)
+    return np.average(durations)
+
+
 def main():
     if len(sys.argv) < 2:
         print("Image the first set of visibilites from a visibilities file")
@@ -25,29 +35,20 @@ def main():
 
     _, body = next(read_full(path))
     cm = correlation_matrix(body, constants.NUM_ANTS)
-    corr_data = np.abs(cm)
-    corr_data[np.diag_indices(constants.NUM_ANTS)] = np.min(corr_data)
-    gains = np.ones((1, constants.NUM_ANTS), dtype=np.complex64)
-    cal_mat = gains.conj().transpose() * gains
-    cm = cal_mat * cm
     U, V = load_antpos(constants.ANTPOS)
     mDuv = constants.C_MS / FRQ / 2.0
 
-    normal = []
-    for i in range(5):
-        start = time.time()
-        grid(U, V, cm, mDuv, constants.IMAGE_RES)
-        end = time.time()
-        normal.append(end-start)
-    print("normal: {}".format(np.average(normal)))
+    for name in available_backends():
+        grid = get_backend(name)
+        print("{}: {}".format(name, timeit(grid, U, V, cm, mDuv,
+                                            constants.IMAGE_RES)))
 
-    fast = []
-    for i in range(5):
-        start = time.time()
-        grid_fast(U, V, cm, mDuv, constants.IMAGE_RES)
-        end = time.time()
-        fast.append(end-start)
-    print("fast: {}".format(np.average(fast)))
+    plan = gridding_plan(FRQ, constants.IMAGE_RES, constants.ANTPOS)
+    print("plan: {}".format(timeit(plan.grid, cm)))
+
+    for name in FFT_BACKENDS:
+        set_fft_backend(name)
+        print("image ({} fft): {}".format(name, timeit(make_image, cm, FRQ)))
 
 if __name__ == '__main__':
     main()
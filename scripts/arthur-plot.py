@@ -1,42 +1,48 @@
 #!/usr/bin/env python3
 
 import sys
-import numpy as np
-from arthur.imaging import full_calculation, calculate_lag
-from arthur.io import read_full
+from arthur.imaging import image_batch, calculate_lag
+from arthur.io import VisFile
 from arthur.plot import plot_image, plot_lag, plot_chan_power, plot_corr_mat, plot_diff
 from arthur.constants import NUM_CHAN
+from arthur.history import History
 from matplotlib import pyplot
 
 FRQ = 58398437.5  # Central observation frequency in Hz
+HISTORY = 60  # number of frames used for the lag and channel history
 
 def main():
     if len(sys.argv) < 2:
-        print("Image the first set of visibilites from a visibilities file")
+        print("Image a set of visibilites from a visibilities file, by "
+              "default the last one")
         print()
-        print("usage: {} <file>".format(sys.argv[0]))
+        print("usage: {} <file> [frame]".format(sys.argv[0]))
         sys.exit(1)
     else:
         path = sys.argv[1]
+        vis = VisFile(path)
+        frame = int(sys.argv[2]) if len(sys.argv) > 2 else len(vis) - 1
+        if frame < 0:
+            frame += len(vis)
 
-    # define them here so we can access them out of for loop scope
-    lags = []
-    prev_data = date = img_data = corr_data = diff_data = None
-    chan_data = np.zeros((NUM_CHAN, 60), dtype=np.float32)
+    # image the whole history window in one batch
+    first = max(0, frame - HISTORY + 1)
+    images, corrs, chans = image_batch(vis.bodies(first, frame + 1), FRQ)
+    dates = [date for date, _ in vis[first:frame + 1]]
 
-    for date, body in read_full(path):
-        img_data, corr_data, chan_row = full_calculation(body, FRQ)
-        lags += [calculate_lag(date).seconds]
-        if prev_data is None:
-            prev_data = img_data
-        chan_data = np.roll(chan_data, 1)
-        chan_data[:, 0] = chan_row
-        diff_data = img_data - prev_data
-        prev_data = img_data
+    lags = History(HISTORY)
+    chan_data = History(HISTORY, shape=(NUM_CHAN,))
+    for date, chan_row in zip(dates, chans):
+        lags.push(calculate_lag(date).seconds)
+        chan_data.push(chan_row)
+    img_data = images[-1]
+    corr_data = corrs[-1]
+    prev_data = images[-2] if len(images) > 1 else img_data
+    diff_data = img_data - prev_data
 
     fig_img = plot_image(date, img_data, FRQ)
-    fig_lag = plot_lag(lags)
-    fig_chan = plot_chan_power(chan_data)
+    fig_lag = plot_lag(lags.view())
+    fig_chan = plot_chan_power(chan_data.view(full=True)[::-1].T)
     fig_cm = plot_corr_mat(corr_data, FRQ, date)
     fig_diff = plot_diff(diff_data, FRQ, date)
     pyplot.show()
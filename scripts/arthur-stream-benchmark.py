@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Feed images through the stream scheduler into a local ffmpeg and report
+the encoder throughput and speed, pipe write stalls, ffmpeg CPU usage and
+the delay between a frame being written and ffmpeg having encoded it.
+"""
+
+import argparse
+import logging
+import queue
+import resource
+import socket
+import threading
+import time
+from multiprocessing import Manager
+import numpy as np
+from arthur import constants
+from arthur.main import result_dtype, stream_scheduler
+from arthur.sharedmem import SharedRing
+from arthur.stream import (FPS, INPUT_RATE, STREAM_RES, loop_images_in_path,
+                           setup_stream_pipe, StreamWriter)
+
+
+def children_cpu_seconds():
+    """ user + system CPU time of the finished child processes """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def synthetic_images(count, size=constants.IMAGE_RES):
+    """ a few noisy images with a source moving over the sky """
+    l = np.linspace(-1, 1, size, dtype=np.float32)
+    images = []
+    for i in range(count):
+        x = np.cos(2 * np.pi * i / count) / 2
+        y = np.sin(2 * np.pi * i / count) / 2
+        source = np.exp(-((l[None, :] - x) ** 2 + (l[:, None] - y) ** 2) / 0.01)
+        images.append(source + np.random.rand(size, size).astype(np.float32) / 10)
+    return images
+
+
+def recorded_images(path, count):
+    """ the first count images from a folder of casacore images """
+    images = loop_images_in_path(path)
+    return [next(images).squeeze().astype(np.float32) for _ in range(count)]
+
+
+def read_progress(stdout, reports):
+    """ collect (time, frame, speed) from the ffmpeg -progress reports """
+    block = {}
+    for line in stdout:
+        key, _, value = line.decode().strip().partition('=')
+        block[key] = value
+        if key == 'progress':
+            try:
+                speed = float(block.get('speed', '0').rstrip('x'))
+            except ValueError:
+                speed = 0.0
+            reports.append((time.monotonic(), int(block.get('frame', 0)),
+                            speed))
+            if value == 'end':
+                return
+            block = {}
+
+
+def tcp_listener(stats):
+    """
+    Listen on a local port and drain whatever ffmpeg sends to it.
+
+    returns:
+        str: the tcp:// url for ffmpeg to connect to
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+
+    def drain():
+        connection, _ = server.accept()
+        while True:
+            data = connection.recv(1 << 16)
+            if not data:
+                return
+            stats['bytes'] += len(data)
+            stats['last'] = time.monotonic()
+
+    threading.Thread(target=drain, daemon=True).start()
+    return 'tcp://127.0.0.1:{}'.format(server.getsockname()[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sink', default='null',
+                        help="'null', 'tcp' for a local listener, a filename "
+                             "or a rtmp url (default: null)")
+    parser.add_argument('--images', help='folder with casacore images, '
+                                         'synthetic images if not given')
+    parser.add_argument('--frames', type=int, default=30,
+                        help='number of images to feed (default: 30)')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='images per second from the imager (default: 1)')
+    parser.add_argument('--input-rate', type=float, default=INPUT_RATE)
+    parser.add_argument('--size', type=int, default=STREAM_RES)
+    parser.add_argument('--preset', default='ultrafast')
+    parser.add_argument('--threads', type=int, default=6)
+    parser.add_argument('--bufsize', default='512k')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.images:
+        images = recorded_images(args.images, min(args.frames, 16))
+    else:
+        images = synthetic_images(16)
+
+    sink = args.sink
+    tcp = {'bytes': 0, 'last': None}
+    if sink == 'tcp':
+        sink = tcp_listener(tcp)
+
+    manager = Manager()
+    # recordings are imaged at any size
+    results = SharedRing(manager, result_dtype(images[0].shape[-1]), 4)
+    pipe = setup_stream_pipe(sink, args.size, args.input_rate, progress=True,
+                             preset=args.preset, threads=args.threads,
+                             bufsize=args.bufsize)
+    reports = []
+    threading.Thread(target=read_progress, args=(pipe.stdout, reports),
+                     daemon=True).start()
+    writer = StreamWriter(pipe, args.size, args.input_rate)
+    stream_queue = queue.Queue()
+    scheduler = threading.Thread(target=stream_scheduler,
+                                 args=(stream_queue, sink, results, writer))
+    scheduler.start()
+
+    cpu_start = children_cpu_seconds()
+    start = time.monotonic()
+    writer.start()
+    for i in range(args.frames):
+        slot = results.acquire()
+        results[slot]['image'] = images[i % len(images)]
+        stream_queue.put((None, slot))
+        time.sleep(max(0, start + (i + 1) / args.rate - time.monotonic()))
+    stream_queue.put(None)
+    scheduler.join()
+    time.sleep(writer.interval)  # let the writer send the last image
+    writer.stop()
+    writer.join()
+    elapsed = time.monotonic() - start
+    # reports made while streaming, ffmpeg flushes the last frame on close
+    live = [report for report in reports if report[1]]
+    pipe.stdin.close()
+    pipe.wait(timeout=30)
+    cpu = children_cpu_seconds() - cpu_start
+    results.close()
+
+    # a frame written at t is due at output frame (t - start) * FPS, so the
+    # encode delay is the time a report arrives minus when its frame was due
+    delays = [t - start - frame / FPS for t, frame, _ in live]
+    if live:
+        last, encoded, speed = live[-1]
+        fps = encoded / (last - start)
+    else:
+        encoded, speed, fps = 0, 0.0, 0.0
+
+    print("sink:               {}".format(args.sink))
+    print("encoder:            preset={} threads={} bufsize={}".format(
+        args.preset, args.threads, args.bufsize))
+    print("duration:           {:.1f} s".format(elapsed))
+    print("frames written:     {} ({} repeats)".format(writer.frames,
+                                                       writer.repeats))
+    print("write stalls:       {}".format(writer.stalls))
+    print("frames encoded:     {} ({:.1f} fps, encoder speed {:.1f}x)".format(
+        encoded, fps, speed))
+    print("ffmpeg cpu:         {:.2f} s ({:.0f}% of one core)".format(
+        cpu, 100 * cpu / elapsed))
+    if delays:
+        print("frame to output:    {:.3f} s mean, {:.3f} s max".format(
+            np.mean(delays), np.max(delays)))
+    if tcp['bytes']:
+        print("tcp received:       {:.1f} kB/s".format(
+            tcp['bytes'] / 1024 / elapsed))
+
+
+if __name__ == '__main__':
+    main()
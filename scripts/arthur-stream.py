@@ -2,7 +2,8 @@
 
 import sys
 import logging
-from arthur.stream import loop_images_in_path, setup_stream_pipe, stream
+import time
+from arthur.stream import ImageLoop, setup_stream_pipe, stream, StreamWriter
 
 if len(sys.argv) < 2:
     print("This will stream a folder of casacore images to youtube")
@@ -15,6 +16,10 @@ else:
 
 
 logging.basicConfig(level=logging.DEBUG)
-images = loop_images_in_path(path)
+images = ImageLoop(path)
 pipe = setup_stream_pipe("rtmp://a.rtmp.youtube.com/live2/" + secret)
-stream(images, pipe)
+writer = StreamWriter(pipe)
+writer.start()
+for frame in images:
+    stream(frame, writer)
+    time.sleep(writer.interval)
@@ -1,4 +1,10 @@
-from setuptools import setup, find_packages
+import os
+from setuptools import setup, find_packages, Extension
+
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    cythonize = None
 
 __version__ = "0.5"
 
@@ -8,14 +14,30 @@ install_requires = (
     'python-casacore',
     'astropy',
     'ephem',
-    'matplotlib',
-    'scipy',
+    'matplotlib>=3.5',  # matplotlib.colormaps
+    'numpy>=1.20',  # norm='forward'
+    'scipy>=1.4',  # scipy.fft with workers
     'monotonic',
     'backports.functools_lru_cache',
     'six',
 )
 
 
+def extensions():
+    """
+    The cython gridder is optional, arthur.gridding falls back to numpy if
+    it is not built. Set ARTHUR_OPENMP=1 to build it with OpenMP support.
+    """
+    if cythonize is None:
+        return []
+    openmp = ['-fopenmp'] if os.environ.get('ARTHUR_OPENMP') == '1' else []
+    gridding_fast = Extension("arthur.gridding_fast",
+                              sources=["arthur/gridding_fast.pyx"],
+                              extra_compile_args=['-O3'] + openmp,
+                              extra_link_args=openmp)
+    return cythonize([gridding_fast])
+
+
 scripts = [
     'scripts/arthur-plot.py',
     'scripts/arthur-stream.py',
@@ -27,6 +49,9 @@ setup(
     packages=find_packages(),
     scripts=scripts,
     install_requires=install_requires,
+    # multiprocessing.shared_memory (arthur.sharedmem) is new in 3.8,
+    # loop.sock_recv_into (arthur.io) in 3.7
+    python_requires='>=3.8',
     package_data={
         '': ['*.txt', '*.rst'],
         'arthur': ['lba_outer.dat'],
@@ -42,9 +67,13 @@ setup(
         "Intended Audience :: Science/Research",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         "Operating System :: POSIX",
-        "Programming Language :: Python :: 3.5",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
         "Topic :: Scientific/Engineering",
         ],
-    #ext_modules=[Extension("gridding_fast",
-    #                       sources=["arthur/gridding_fast.pyx"])],
+    ext_modules=extensions(),
 )
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from arthur import calibration
+from arthur import constants
+from arthur import imaging
+
+FRQ = 58398437.5  # Central observation frequency in Hz
+
+
+def random_complex(random, *shape):
+    return (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+
+
+class testCalibration(unittest.TestCase):
+    def setUp(self):
+        self.random = np.random.RandomState(0)
+        self.body = random_complex(self.random, constants.NUM_CHAN,
+                                   constants.NUM_BSLN)
+        self.cm = imaging.correlation_matrix(self.body, constants.NUM_ANTS)
+        self.gains = random_complex(self.random, constants.NUM_ANTS)
+
+    def test_unity(self):
+        cm = self.cm.copy()
+        self.assertIs(calibration.apply_gains(cm, calibration.unity_gains()), cm)
+        self.assertTrue(np.array_equal(cm, self.cm))
+        self.assertIs(calibration.calibrate_body(self.body, None), self.body)
+
+    def test_apply_gains(self):
+        table = calibration.GainTable(self.gains)
+        cm = calibration.apply_gains(self.cm.copy(), table)
+        g = self.gains[:, np.newaxis]
+        expected = g * self.cm * g.conj().T
+        self.assertTrue(np.allclose(cm, expected, atol=1e-5))
+
+        triangle = calibration.calibrated_mean(self.body, table)
+        calibrated = imaging.correlation_matrix(triangle[np.newaxis],
+                                                constants.NUM_ANTS)
+        self.assertTrue(np.allclose(calibrated, expected, atol=1e-5))
+
+    def test_flags(self):
+        flags = np.zeros(constants.NUM_ANTS, dtype=bool)
+        flags[[3, 100]] = True
+        table = calibration.GainTable(np.ones(constants.NUM_ANTS), flags)
+        self.assertFalse(table.unity)
+        cm = calibration.apply_gains(self.cm.copy(), table)
+        self.assertFalse(cm[3].any() or cm[:, 100].any())
+        self.assertTrue(np.array_equal(cm[4, 5], self.cm[4, 5]))
+
+    def test_channel_gains(self):
+        gains = random_complex(self.random, constants.NUM_CHAN,
+                               constants.NUM_ANTS)
+        table = calibration.GainTable(gains)
+        body = calibration.calibrate_body(self.body, table)
+        a1, a2 = np.tril_indices(constants.NUM_ANTS)
+        channel = 7
+        expected = self.body[channel] * gains[channel, a1] * gains[channel, a2].conj()
+        self.assertTrue(np.allclose(body[channel], expected, atol=1e-5))
+        mean = calibration.calibrated_mean(self.body, table)
+        self.assertTrue(np.allclose(mean, body.mean(axis=0), atol=1e-5))
+
+    def test_images(self):
+        table = calibration.GainTable(self.gains)
+        expected = imaging.make_image(self.cm.copy(), FRQ, gains=table)
+        result = imaging.make_image_hermitian(self.body.mean(axis=0), FRQ,
+                                              gains=table)
+        self.assertTrue(np.allclose(result, expected, atol=1e-2))
+
+
+class testLoadGains(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_npy(self):
+        filename = os.path.join(self.folder, 'gains.npy')
+        np.save(filename, np.full(constants.NUM_ANTS, 2, dtype=np.complex64))
+        table = calibration.load_gains(filename)
+        self.assertIsInstance(table.gains, np.memmap)
+        self.assertIs(calibration.load_gains(filename), table)
+
+        np.save(filename, np.ones(constants.NUM_ANTS, dtype=np.complex64))
+        os.utime(filename, ns=(0, os.stat(filename).st_mtime_ns + 1))
+        reloaded = calibration.load_gains(filename)
+        self.assertIsNot(reloaded, table)
+        self.assertTrue(reloaded.unity)
+
+    def test_npz(self):
+        filename = os.path.join(self.folder, 'gains.npz')
+        flags = np.zeros(constants.NUM_ANTS, dtype=bool)
+        flags[5] = True
+        np.savez(filename, gains=np.ones((2, constants.NUM_ANTS)), flags=flags)
+        table = calibration.load_gains(filename)
+        self.assertEqual(table.channels, 2)
+        self.assertEqual(table.antenna_gains()[5], 0)
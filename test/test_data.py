@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from arthur import constants
+from arthur.data import load_antpos, baselines, ROTATION
+
+
+class testData(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.antpos = os.path.join(self.folder, 'antpos.dat')
+        shutil.copy(constants.ANTPOS, self.antpos)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_baselines(self):
+        L = np.loadtxt(self.antpos).dot(ROTATION)
+        uvw = baselines(self.antpos)
+        a1, a2 = 17, 201
+        self.assertTrue(np.array_equal(uvw[:, a1, a2], L[a1] - L[a2]))
+        self.assertTrue(np.array_equal(uvw, -uvw.transpose(0, 2, 1)))
+
+    def test_cache(self):
+        first = baselines(self.antpos)
+        caches = [f for f in os.listdir(self.folder) if f.endswith('.uvw.npy')]
+        self.assertEqual(len(caches), 1)
+        second = baselines(self.antpos)
+        self.assertIsInstance(second, np.memmap)
+        self.assertTrue(np.array_equal(first, second))
+        baselines(self.antpos, rotation=np.eye(3))
+        caches = [f for f in os.listdir(self.folder) if f.endswith('.uvw.npy')]
+        self.assertEqual(len(caches), 2)
+
+    def test_load_antpos(self):
+        U, V = load_antpos(self.antpos)
+        U, V, W = load_antpos(self.antpos, with_w=True)
+        self.assertEqual(W.shape, (constants.NUM_ANTS, constants.NUM_ANTS))
+        self.assertFalse(U.flags.writeable)
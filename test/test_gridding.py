@@ -1,10 +1,15 @@
 import unittest
+from os import path
 
 from arthur.data import load_antpos
 import numpy as np
 from arthur import gridding
 from arthur import constants
+from arthur.imaging import correlation_matrix
+from arthur.io import read_data
 
+HERE = path.dirname(__file__)
+VIS_PATH = path.join(HERE, 'data/2aartfaac.vis')
 FRQ = 58398437.5  # Central observation frequency in Hz
 
 
@@ -20,4 +25,108 @@ class testGridding(unittest.TestCase):
         size = constants.IMAGE_RES
         gridding.grid(U, V, C, duv, size)
 
+    def test_grid_vectorized(self):
+        U, V = load_antpos(constants.ANTPOS)
+        shape = (constants.NUM_ANTS, constants.NUM_ANTS)
+        random = np.random.RandomState(0)
+        C = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        duv = constants.C_MS / FRQ / 2.0
+        size = constants.IMAGE_RES
+        expected = gridding.grid(U, V, C, duv, size)
+        result = gridding.grid_vectorized(U, V, C, duv, size)
+        self.assertEqual(result.dtype, expected.dtype)
+        self.assertTrue(np.array_equal(result, expected))
+
+    @unittest.skipUnless(path.exists(VIS_PATH), "sample visibilities not extracted")
+    def test_grid_vectorized_sample(self):
+        _, body = read_data(open(VIS_PATH, 'rb'))
+        C = correlation_matrix(body, constants.NUM_ANTS)
+        U, V = load_antpos(constants.ANTPOS)
+        duv = constants.C_MS / FRQ / 2.0
+        size = constants.IMAGE_RES
+        expected = gridding.grid(U, V, C, duv, size)
+        result = gridding.grid_vectorized(U, V, C, duv, size)
+        self.assertTrue(np.array_equal(result, expected))
+
+    def test_gridding_plan(self):
+        U, V = load_antpos(constants.ANTPOS)
+        shape = (constants.NUM_ANTS, constants.NUM_ANTS)
+        random = np.random.RandomState(0)
+        C = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        duv = constants.C_MS / FRQ / 2.0
+        size = constants.IMAGE_RES
+        plan = gridding.gridding_plan(FRQ, size, constants.ANTPOS)
+        self.assertIs(plan, gridding.gridding_plan(FRQ, size, constants.ANTPOS))
+        expected = gridding.grid_vectorized(U, V, C, duv, size)
+        result = plan.grid(C)
+        self.assertEqual(result.dtype, np.complex64)
+        self.assertTrue(np.allclose(result, expected, atol=1e-3))
 
+    def test_get_backend(self):
+        self.assertIs(gridding.get_backend('python'), gridding.grid)
+        self.assertIs(gridding.get_backend('numpy'), gridding.grid_vectorized)
+        self.assertIn('numpy', gridding.available_backends())
+        self.assertRaises(ValueError, gridding.get_backend, 'fortran')
+
+    @unittest.skipUnless('cython' in gridding.available_backends(),
+                         "cython gridder not built")
+    def test_grid_cython(self):
+        U, V = load_antpos(constants.ANTPOS)
+        shape = (constants.NUM_ANTS, constants.NUM_ANTS)
+        random = np.random.RandomState(0)
+        C = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        duv = constants.C_MS / FRQ / 2.0
+        size = constants.IMAGE_RES
+        expected = gridding.grid_vectorized(U, V, C, duv, size)
+        grid_fast = gridding.get_backend('cython')
+        self.assertTrue(np.array_equal(grid_fast(U, V, C, duv, size), expected))
+        self.assertTrue(np.allclose(grid_fast(U, V, C, duv, size, 4), expected,
+                                    atol=1e-3))
+
+    def test_grid_outside(self):
+        # at 90 MHz the longest baselines fall off a 256 grid of half
+        # wavelength cells
+        U, V = load_antpos(constants.ANTPOS)
+        C = np.ones((constants.NUM_ANTS, constants.NUM_ANTS), dtype=np.complex64)
+        duv = constants.C_MS / 90e6 / 2.0
+        for name in gridding.available_backends():
+            grid = gridding.get_backend(name)
+            self.assertRaises(IndexError, grid, U, V, C, duv,
+                              constants.IMAGE_RES)
+
+    def test_gridding_plan_outside(self):
+        self.assertEqual(gridding.gridding_plan(FRQ, constants.IMAGE_RES,
+                                                constants.ANTPOS).outside, 0)
+        with self.assertLogs('arthur.gridding', 'WARNING'):
+            plan = gridding.gridding_plan(90e6, constants.IMAGE_RES,
+                                          constants.ANTPOS, 0.5)
+        self.assertGreater(plan.outside, 0)
+        # nothing wraps around onto the opposite edge, the plan grids the
+        # baselines it keeps onto the centre of a grid twice as large
+        U, V = load_antpos(constants.ANTPOS)
+        random = np.random.RandomState(0)
+        shape = (constants.NUM_ANTS, constants.NUM_ANTS)
+        C = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        size = constants.IMAGE_RES
+        inside = gridding.on_grid(U, V, plan.duv, size)
+        self.assertTrue(np.array_equal(inside, inside.T))
+        expected = gridding.grid_vectorized(U, V, np.where(inside, C, 0),
+                                            plan.duv, 2 * size)
+        expected = expected[size // 2:size // 2 + size,
+                            size // 2:size // 2 + size]
+        self.assertTrue(np.allclose(plan.grid(C), expected, atol=1e-3))
+
+    def test_hermitian_plan_outside(self):
+        size = constants.IMAGE_RES
+        self.assertEqual(gridding.hermitian_gridding_plan(
+            FRQ, size, constants.ANTPOS).outside, 0)
+        with self.assertLogs('arthur.gridding', 'WARNING'):
+            plan = gridding.hermitian_gridding_plan(90e6, size,
+                                                    constants.ANTPOS, 0.5)
+        self.assertGreater(plan.outside, 0)
+        self.assertEqual(plan.outside, gridding.gridding_plan(
+            90e6, size, constants.ANTPOS, 0.5).outside)
+        with self.assertLogs('arthur.gridding', 'WARNING'):
+            channels = gridding.channel_gridding_plan((FRQ, 90e6), size,
+                                                      constants.ANTPOS)
+        self.assertEqual(channels.outside, plan.outside)
@@ -0,0 +1,22 @@
+import unittest
+import numpy as np
+from arthur.history import History
+
+
+class testHistory(unittest.TestCase):
+    def test_push(self):
+        history = History(depth=3)
+        self.assertEqual(len(history), 0)
+        self.assertEqual(history.view().shape, (0,))
+        for value in range(5):
+            history.push(value)
+        self.assertEqual(len(history), 3)
+        self.assertTrue(np.array_equal(history.view(), [2, 3, 4]))
+
+    def test_full(self):
+        history = History(depth=4, shape=(2,))
+        history.push([1, 2])
+        view = history.view(full=True)
+        self.assertEqual(view.shape, (4, 2))
+        self.assertTrue(np.array_equal(view[-1], [1, 2]))
+        self.assertTrue(np.array_equal(view[:-1], np.zeros((3, 2))))
@@ -1,6 +1,8 @@
 import unittest
 from arthur import imaging
 from arthur import constants
+from arthur.data import load_antpos
+from arthur.gridding import get_backend
 import numpy as np
 
 
@@ -22,3 +24,107 @@ class testImaging(unittest.TestCase):
         cm = np.zeros((constants.NUM_ANTS, constants.NUM_ANTS),
                      dtype=np.complex64)
         imaging.make_image(cm, FRQ)
+
+    def test_make_image_hermitian(self):
+        random = np.random.RandomState(0)
+        shape = (constants.NUM_CHAN, constants.NUM_BSLN)
+        body = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        cm = imaging.correlation_matrix(body, constants.NUM_ANTS)
+        expected = imaging.make_image(cm, FRQ)
+        result = imaging.make_image_hermitian(body.mean(axis=0), FRQ)
+        self.assertEqual(result.shape, expected.shape)
+        self.assertTrue(np.allclose(result, expected, atol=1e-3))
+
+    def test_make_image_cube(self):
+        random = np.random.RandomState(0)
+        shape = (constants.NUM_CHAN, constants.NUM_BSLN, constants.NUM_POLS)
+        body = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        frequencies = imaging.channel_frequencies(FRQ)
+        self.assertAlmostEqual(frequencies.mean(), FRQ)
+
+        cube = imaging.make_image_cube(body, FRQ, mfs=False)
+        self.assertEqual(cube.shape, (3, constants.NUM_CHAN,
+                                      constants.IMAGE_RES, constants.IMAGE_RES))
+        expected = imaging.make_image_hermitian(body[10, :, 1], frequencies[10])
+        self.assertTrue(np.allclose(cube[1, 10], expected, atol=1e-2))
+
+        images = imaging.make_image_cube(body, FRQ)
+        self.assertEqual(images.shape, (3, constants.IMAGE_RES, constants.IMAGE_RES))
+        self.assertTrue(np.allclose(images, cube.mean(axis=1), atol=1e-2))
+        self.assertTrue(np.allclose(images[2], images[:2].mean(axis=0), atol=1e-3))
+
+    def test_image_batch(self):
+        random = np.random.RandomState(0)
+        shape = (3, constants.NUM_CHAN, constants.NUM_BSLN)
+        bodies = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        images, corr, chan = imaging.image_batch(bodies, FRQ)
+        self.assertEqual(images.shape, (3, constants.IMAGE_RES, constants.IMAGE_RES))
+        for i, body in enumerate(bodies):
+            image, corr_data, chan_row = imaging.full_calculation(body, FRQ)
+            self.assertTrue(np.allclose(images[i], image, atol=1e-3))
+            self.assertTrue(np.allclose(corr[i], corr_data, atol=1e-5))
+            self.assertTrue(np.allclose(chan[i], chan_row, atol=1e-3))
+
+    def test_image_size(self):
+        self.assertEqual(imaging.fft_size(256), 256)
+        self.assertEqual(imaging.fft_size(260), 270)
+        padded, cell = imaging.grid_geometry(260)
+        self.assertEqual(padded, 270)
+        self.assertAlmostEqual(cell * padded, constants.UV_CELL * 260)
+
+        # a point source lands on the same direction at every size
+        U, V = load_antpos(constants.ANTPOS)
+        wavelength = constants.C_MS / FRQ
+        l, m = 0.3, -0.2
+        cm = np.exp(2j * np.pi * (U * l + V * m) / wavelength)
+        cm = cm.astype(np.complex64)
+        a1, a2 = np.tril_indices(constants.NUM_ANTS)
+        peaks = []
+        for size, cell in ((256, 0.5), (260, 0.5), (200, 1.0)):
+            image = imaging.make_image(cm.copy(), FRQ, size=size, cell=cell)
+            self.assertEqual(image.shape, (size, size))
+            hermitian = imaging.make_image_hermitian(cm[a1, a2], FRQ,
+                                                     size=size, cell=cell)
+            # a single precision point source of NUM_ANTS ** 2 visibilities
+            self.assertTrue(np.allclose(image, hermitian,
+                                        atol=1e-6 * image.max()))
+            y, x = np.unravel_index(np.argmax(image), image.shape)
+            # in units of direction cosines
+            peaks.append((np.array([y, x]) - size // 2) / (size * cell))
+        for peak in peaks[1:]:
+            self.assertTrue(np.allclose(peak, peaks[0], atol=0.01))
+
+    def test_fft_backends(self):
+        random = np.random.RandomState(0)
+        shape = (constants.NUM_CHAN, constants.NUM_BSLN)
+        body = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        cm = imaging.correlation_matrix(body, constants.NUM_ANTS)
+        self.assertRaises(ValueError, imaging.get_fft_backend, 'fftw3')
+        try:
+            images = []
+            for name in imaging.FFT_BACKENDS:
+                imaging.set_fft_backend(name)
+                self.assertEqual(imaging.fft_backend().name, name)
+                out = np.empty((260, 260), dtype=np.float32)
+                image = imaging.make_image_hermitian(body.mean(axis=0), FRQ,
+                                                     size=260, out=out)
+                self.assertIs(image, out)
+                gridded = imaging.make_image(cm.copy(), FRQ, size=260,
+                                             gridder=get_backend('numpy'))
+                self.assertTrue(np.allclose(gridded, image, atol=1e-3))
+                images.append(image)
+            self.assertTrue(np.allclose(images[0], images[1], atol=1e-3))
+        finally:
+            imaging.set_fft_backend(None)
+
+    def test_off_grid(self):
+        # at 90 MHz baselines fall off the grid, both planes leave out the
+        # same ones
+        random = np.random.RandomState(0)
+        shape = (constants.NUM_CHAN, constants.NUM_BSLN)
+        body = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        cm = imaging.correlation_matrix(body, constants.NUM_ANTS)
+        with self.assertLogs('arthur.gridding', 'WARNING'):
+            expected = imaging.make_image(cm, 90e6)
+        result = imaging.make_image_hermitian(body.mean(axis=0), 90e6)
+        self.assertTrue(np.allclose(result, expected, atol=1e-3))
@@ -0,0 +1,65 @@
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+from arthur import constants
+from arthur.imaging import full_calculation, triangle_calculation
+from arthur.integration import Integrator, integrate
+
+FRQ = 58398437.5  # Central observation frequency in Hz
+START = datetime(2016, 6, 2, 21, 29, 58)
+
+
+def make_frames(count, seconds=None):
+    random = np.random.RandomState(0)
+    shape = (constants.NUM_CHAN, constants.NUM_BSLN)
+    for i in range(count):
+        body = (random.randn(*shape) + 1j * random.randn(*shape)).astype(np.complex64)
+        offset = seconds[i] if seconds else i
+        yield START + timedelta(seconds=offset), body
+
+
+class testIntegration(unittest.TestCase):
+    def test_window(self):
+        self.assertRaises(ValueError, Integrator)
+
+    def test_tumbling(self):
+        frames = list(make_frames(6))
+        windows = list(integrate(frames, Integrator(frames=3)))
+        self.assertEqual(len(windows), 2)
+        date, triangle, channels = windows[1]
+        self.assertEqual(date, frames[5][0])
+        bodies = np.array([body for _, body in frames[3:]])
+        self.assertTrue(np.allclose(triangle, bodies.mean(axis=(0, 1)), atol=1e-6))
+        self.assertTrue(np.allclose(channels, bodies.mean(axis=(0, 2)), atol=1e-6))
+
+    def test_single_frame(self):
+        (date, body), = make_frames(1)
+        (_, triangle, channels), = integrate([(date, body)], Integrator(frames=1))
+        image, corr_data, chan_row = triangle_calculation(triangle, channels, FRQ)
+        expected = full_calculation(body, FRQ)
+        self.assertTrue(np.allclose(image, expected[0], atol=1e-3))
+        self.assertTrue(np.allclose(corr_data, expected[1], atol=1e-5))
+        self.assertTrue(np.allclose(chan_row, expected[2], atol=1e-4))
+
+    def test_sliding(self):
+        frames = list(make_frames(8))
+        integrator = Integrator(frames=3, sliding=True, step=2)
+        windows = list(integrate(frames, integrator))
+        self.assertEqual([date for date, _, _ in windows],
+                         [frames[i][0] for i in (2, 4, 6)])
+        bodies = np.array([body for _, body in frames[4:7]])
+        self.assertTrue(np.allclose(windows[-1][1], bodies.mean(axis=(0, 1)),
+                                    atol=1e-6))
+        self.assertEqual(len(integrator), 3)
+
+    def test_seconds(self):
+        # a gap after the second frame closes the first window early
+        frames = list(make_frames(5, seconds=[0, 1, 5, 6, 7]))
+        windows = list(integrate(frames, Integrator(seconds=3)))
+        self.assertEqual([date for date, _, _ in windows],
+                         [frames[1][0], frames[4][0]])
+
+        integrator = Integrator(seconds=3, sliding=True)
+        windows = list(integrate(frames, integrator))
+        self.assertEqual([date for date, _, _ in windows], [frames[4][0]])
+        self.assertEqual(len(integrator), 3)
@@ -0,0 +1,143 @@
+import asyncio
+import gc
+import socket
+import struct
+import tempfile
+import unittest
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+from arthur import io
+from arthur import constants
+
+
+def make_frame(start, seed=0):
+    header = struct.pack("<IIdd", constants.HDR_MAGIC, 0, start, start + 1)
+    return header.ljust(constants.LEN_HDR, b'\0') + make_raw_body(seed)
+
+
+def make_raw_body(seed=0):
+    random = np.random.RandomState(seed)
+    count = constants.LEN_BDY // 8
+    serial = (random.randn(count) + 1j * random.randn(count)).astype(np.complex64)
+    return serial.tobytes()
+
+
+class testIo(unittest.TestCase):
+    def test_parse_body(self):
+        raw_body = make_raw_body()
+        serial = np.frombuffer(raw_body, dtype=np.complex64)
+        for pol in range(constants.NUM_POLS):
+            indices = io.create_indices(pol, constants.NUM_CHAN,
+                                        constants.NUM_BSLN, constants.NUM_POLS)
+            expected = io.reshape_body(serial, indices, constants.NUM_CHAN,
+                                       constants.NUM_BSLN)
+            body = io.parse_body(raw_body, pol=pol)
+            self.assertEqual(body.shape, (constants.NUM_CHAN, constants.NUM_BSLN))
+            self.assertTrue(np.array_equal(body, expected))
+
+    def test_parse_body_pols(self):
+        raw_body = make_raw_body()
+        body = io.parse_body(raw_body, pol=(0, 1))
+        self.assertEqual(body.shape, (constants.NUM_CHAN, constants.NUM_BSLN, 2))
+        self.assertTrue(np.shares_memory(body, np.frombuffer(raw_body, np.complex64)))
+        self.assertTrue(np.array_equal(body[..., 1], io.parse_body(raw_body, pol=1)))
+        swapped = io.parse_body(raw_body, pol=(1, 0), copy=True)
+        self.assertTrue(swapped.flags['C_CONTIGUOUS'])
+        self.assertTrue(np.array_equal(swapped[..., 0], body[..., 1]))
+
+    def test_read_data_pool(self):
+        frame = make_frame(1e9)
+        pool = io.BufferPool(size=1)
+        date, body = io.read_data(BytesIO(frame), pool=pool)
+        self.assertEqual(date, datetime.utcfromtimestamp(1e9))
+        self.assertTrue(np.array_equal(body, io.parse_body(frame[constants.LEN_HDR:])))
+        self.assertEqual(len(pool), 0)
+        view = body[:, 0]
+        del body
+        gc.collect()
+        self.assertEqual(len(pool), 0)
+        del view
+        gc.collect()
+        self.assertEqual(len(pool), 1)
+
+    def test_reader_socket(self):
+        left, right = socket.socketpair()
+        right.sendall(b'aartfaac')
+        buffer_ = bytearray(8)
+        self.assertIs(io.reader(left, 8, buffer_), buffer_)
+        self.assertEqual(bytes(buffer_), b'aartfaac')
+        right.close()
+        self.assertRaises(IOError, io.reader, left, 8)
+
+    def test_vis_file(self):
+        frames = [make_frame(1e9 + i, seed=i) for i in range(3)]
+        with tempfile.NamedTemporaryFile() as handler:
+            handler.write(b''.join(frames))
+            handler.flush()
+            with io.VisFile(handler.name) as vis:
+                self.assertEqual(len(vis), 3)
+                date, body = vis[-1]
+                self.assertEqual(date, datetime.utcfromtimestamp(1e9 + 2))
+                expected = io.parse_body(frames[2][constants.LEN_HDR:])
+                self.assertTrue(np.array_equal(body, expected))
+                self.assertEqual([d for d, _ in vis[1:]],
+                                 [datetime.utcfromtimestamp(1e9 + i) for i in (1, 2)])
+                selected = vis.time_range(datetime.utcfromtimestamp(1e9 + 1),
+                                          datetime.utcfromtimestamp(1e9 + 2))
+                self.assertEqual(len(selected), 1)
+                self.assertRaises(IndexError, vis.__getitem__, 3)
+                self.assertEqual(len(list(vis)), 3)
+
+    def test_vis_file_no_header(self):
+        for content in (b'', make_frame(1e9)[:constants.LEN_HDR - 1]):
+            with tempfile.NamedTemporaryFile() as handler:
+                handler.write(content)
+                handler.flush()
+                with self.assertRaisesRegex(IOError, 'no valid header'):
+                    io.VisFile(handler.name)
+
+    def test_vis_file_bodies(self):
+        frames = [make_frame(1e9 + i, seed=i) for i in range(3)]
+        with tempfile.NamedTemporaryFile() as handler:
+            handler.write(b''.join(frames))
+            handler.flush()
+            with io.VisFile(handler.name, pol=(0, 1)) as vis:
+                bodies = vis.bodies(1)
+                self.assertEqual(bodies.shape, (2, constants.NUM_CHAN,
+                                                constants.NUM_BSLN,
+                                                constants.NUM_POLS))
+                for i, (_, body) in enumerate(vis[1:]):
+                    self.assertTrue(np.array_equal(bodies[i], body))
+                self.assertEqual(len(vis.bodies(3)), 0)
+                del bodies, body
+
+    def test_async_vis_server(self):
+        loop = asyncio.new_event_loop()
+        server = io.AsyncVisServer(port=0, maxsize=1)
+
+        async def send(start):
+            _, writer = await asyncio.open_connection('localhost', server.port)
+            writer.write(make_frame(start))
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            await server.start()
+            await asyncio.gather(send(1e9), send(1e9 + 1))
+            while sum(c.frames for c in server.connections) < 2:
+                await asyncio.sleep(0.01)
+            date, body = await server.get()
+            await server.stop()
+            return date, body
+
+        try:
+            date, body = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertIn(date, [datetime.utcfromtimestamp(1e9 + i) for i in (0, 1)])
+        self.assertEqual(body.shape, (constants.NUM_CHAN, constants.NUM_BSLN))
+        self.assertEqual(server.dropped, 1)
+        self.assertEqual(len(server.connections), 2)
+        self.assertEqual([c.bytes for c in server.connections],
+                         [constants.LEN_HDR + constants.LEN_BDY] * 2)
@@ -0,0 +1,35 @@
+import unittest
+from datetime import datetime
+import numpy as np
+from arthur import constants
+from arthur.plot import PlotRenderer
+
+FRQ = 58398437.5  # Central observation frequency in Hz
+
+
+class testPlotRenderer(unittest.TestCase):
+    def test_render(self):
+        renderer = PlotRenderer(FRQ)
+        date = datetime(2016, 6, 2, 21, 29, 58)
+        size = constants.IMAGE_RES
+        image = np.random.rand(size, size)
+        for i in range(2):
+            figures = renderer.render(date, image, np.arange(i + 1),
+                                      np.random.rand(constants.NUM_CHAN, 60),
+                                      np.random.rand(constants.NUM_ANTS,
+                                                     constants.NUM_ANTS),
+                                      image - image)
+        self.assertEqual([name for name, _ in figures], list(PlotRenderer.names))
+        self.assertIs(figures[0][1], renderer.figures['image'])
+        self.assertEqual(renderer.figures['image'].axes[0].get_title(),
+                         'XX-58.40 MHz-2016-06-02_21:29:58 ')
+        for _, figure in figures:
+            figure.canvas.draw()
+
+    def test_chan_depth(self):
+        renderer = PlotRenderer(FRQ)
+        figure = renderer.update_chan(np.random.rand(constants.NUM_CHAN, 120))
+        ax = figure.axes[0]
+        self.assertEqual(ax.get_xlim(), (-0.5, 119.5))
+        self.assertEqual(ax.get_ylim(), (constants.NUM_CHAN - 0.5, -0.5))
+        figure.canvas.draw()
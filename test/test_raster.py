@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+from arthur import raster
+
+
+class testRaster(unittest.TestCase):
+    def test_colorize(self):
+        data = np.linspace(0, 1, 16).reshape(4, 4)
+        rgb = raster.colorize(data, 'afmhot')
+        self.assertEqual(rgb.shape, (4, 4, 3))
+        self.assertEqual(rgb.dtype, np.uint8)
+        lut = raster.colormap_lut('afmhot')
+        self.assertTrue(np.array_equal(rgb[0, 0], lut[0]))
+        self.assertTrue(np.array_equal(rgb[-1, -1], lut[255]))
+
+    def test_matplotlib(self):
+        import matplotlib
+        from matplotlib.colors import Normalize
+        random = np.random.RandomState(0)
+        for data in (random.randn(64, 64),
+                     random.randn(64, 64).astype(np.float32)):
+            for cmap, vmin, vmax in (('jet', None, None),
+                                     ('coolwarm', -1.0, 1.5)):
+                norm = Normalize(vmin, vmax)(data)
+                expected = matplotlib.colormaps[cmap](norm, bytes=True)
+                rgb = raster.colorize(data, cmap, vmin, vmax)
+                self.assertTrue(np.array_equal(rgb, expected[..., :3]))
+
+    def test_mask(self):
+        mask = raster.horizon_mask(8)
+        self.assertTrue(mask[0, 0])
+        self.assertFalse(mask[4, 4])
+        rgb = raster.colorize(np.ones((8, 8)), mask=mask, bad=(1, 2, 3))
+        self.assertEqual(tuple(rgb[0, 0]), (1, 2, 3))
+
+    def test_write_png(self):
+        rgb = raster.colorize(np.random.rand(16, 16), 'coolwarm')
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'diff.png')
+            raster.write_png(filename, rgb, compress_level=0)
+            self.assertTrue(np.array_equal(np.asarray(Image.open(filename)), rgb))
@@ -0,0 +1,60 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from arthur.scheduler import PipelineScheduler
+
+
+def slow_identity(date, delay, event=None):
+    if event:
+        event.wait()
+    time.sleep(delay)
+    return date
+
+
+class testPipelineScheduler(unittest.TestCase):
+    def test_order(self):
+        emitted = []
+        with ThreadPoolExecutor(4) as executor:
+            scheduler = PipelineScheduler(executor, slow_identity,
+                                          emitted.append, max_inflight=4)
+            for date in range(4):
+                scheduler.submit(date, 0.05 * (4 - date))
+            scheduler.join()
+        self.assertEqual(emitted, [0, 1, 2, 3])
+        self.assertEqual(scheduler.completed, 4)
+        self.assertEqual(scheduler.dropped, 0)
+
+    def test_newest(self):
+        emitted = []
+        dropped = []
+        event = threading.Event()
+        with ThreadPoolExecutor(1) as executor:
+            scheduler = PipelineScheduler(executor, slow_identity,
+                                          emitted.append, max_inflight=1,
+                                          policy='newest',
+                                          on_drop=lambda d, *a: dropped.append(d))
+            for date in range(4):
+                scheduler.submit(date, 0, event)
+            event.set()
+            scheduler.join()
+        self.assertEqual(emitted, [0, 3])
+        self.assertEqual(dropped, [1, 2])
+        self.assertEqual(scheduler.dropped, 2)
+
+    def test_drop_oldest(self):
+        emitted = []
+        event = threading.Event()
+        with ThreadPoolExecutor(1) as executor:
+            scheduler = PipelineScheduler(executor, slow_identity,
+                                          emitted.append, max_inflight=1,
+                                          policy='drop-oldest', backlog=2)
+            for date in range(5):
+                scheduler.submit(date, 0, event)
+            event.set()
+            scheduler.join()
+        self.assertEqual(emitted, [0, 3, 4])
+
+    def test_policy(self):
+        self.assertRaises(ValueError, PipelineScheduler, None, None, None,
+                          policy='panic')
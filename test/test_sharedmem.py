@@ -0,0 +1,47 @@
+import pickle
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+import numpy as np
+from arthur.sharedmem import SharedRing
+
+
+def double(ring, slot):
+    ring[slot][...] *= 2
+    ring.release(slot)
+
+
+class testSharedRing(unittest.TestCase):
+    def setUp(self):
+        self.manager = Manager()
+        self.ring = SharedRing(self.manager, ('f4', (4, 4)), 2)
+
+    def tearDown(self):
+        self.ring.close()
+        self.manager.shutdown()
+
+    def test_release(self):
+        slot = self.ring.acquire(consumers=2)
+        other = self.ring.acquire()
+        self.assertNotEqual(slot, other)
+        self.ring.release(slot)
+        self.ring.release(other)
+        self.assertEqual(self.ring.acquire(), other)
+        self.ring.release(slot)
+        self.assertEqual(self.ring.acquire(), slot)
+
+    def test_process(self):
+        slot = self.ring.acquire(consumers=1)
+        self.ring[slot][...] = np.arange(16).reshape(4, 4)
+        with ProcessPoolExecutor(1) as executor:
+            executor.submit(double, self.ring, slot).result()
+        self.assertTrue(np.array_equal(self.ring[slot],
+                                       2 * np.arange(16).reshape(4, 4)))
+        self.assertEqual({self.ring.acquire(), self.ring.acquire()}, {0, 1})
+
+    def test_pickle(self):
+        slot = self.ring.acquire()
+        self.ring[slot][...] = 1
+        other = pickle.loads(pickle.dumps(self.ring))
+        self.assertTrue(np.array_equal(other[slot], self.ring[slot]))
+        other.close()
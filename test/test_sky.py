@@ -0,0 +1,41 @@
+import unittest
+from datetime import datetime, timedelta
+import ephem
+import numpy as np
+from arthur import sky
+from arthur import plot
+
+
+class testSky(unittest.TestCase):
+    def test_masks(self):
+        self.assertIs(sky.horizon_mask(16), sky.horizon_mask(16))
+        mask = sky.nan_mask(16)
+        self.assertTrue(np.isnan(mask[0, 0]))
+        self.assertEqual(mask[8, 8], 1)
+        self.assertEqual(np.isnan(mask).sum(), sky.horizon_mask(16).sum())
+
+    def test_cell(self):
+        l, m = sky.lm_axes(16, cell=1.0)
+        self.assertEqual(l[-1], 0.5)
+        self.assertEqual(sky.horizon_mask(16, 1.0).sum(), 0)
+        self.assertGreater(sky.horizon_mask(16, 0.5).sum(), 0)
+
+    def test_annotations(self):
+        date = datetime(2016, 6, 2, 21, 29, 58)
+        annotations = sky.calculate_annotations(date, bucket=0)
+        obs = ephem.Observer()
+        obs.pressure = 0
+        obs.lon, obs.lat = '6.869837540', '52.915122495'
+        obs.date = date
+        cas_a = ephem.readdb('Cas-A,f|J,23:23:26.0,58:48:00,99.00,2000')
+        cas_a.compute(obs)
+        expected = (-(np.cos(cas_a.alt) * np.sin(cas_a.az)),
+                    np.cos(cas_a.alt) * np.cos(cas_a.az))
+        self.assertTrue(np.allclose(annotations['Cas-A'], expected))
+
+    def test_bucket(self):
+        date = datetime(2016, 6, 2, 21, 29, 58)
+        self.assertIs(plot.calculate_annotations(date),
+                      sky.calculate_annotations(date + timedelta(seconds=1)))
+        self.assertIsNot(sky.calculate_annotations(date),
+                         sky.calculate_annotations(date + timedelta(seconds=10)))
@@ -0,0 +1,104 @@
+import io
+import itertools
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+from arthur.stream import (serialize_array, StreamWriter, ImageLoop, make_cmd,
+                           sink_args)
+
+
+class FakePipe(object):
+    def __init__(self):
+        self.stdin = io.BytesIO()
+
+    def poll(self):
+        return None
+
+
+class testStream(unittest.TestCase):
+    def setUp(self):
+        self.image = np.random.rand(1, 1, 256, 256).astype(np.float32) * 10 - 3
+
+    def test_serialize_array(self):
+        original = self.image.copy()
+        frame = serialize_array(self.image)
+        self.assertTrue(np.array_equal(self.image, original))
+        self.assertEqual(frame.shape, (256, 256))
+        self.assertEqual(frame.dtype, np.uint8)
+        self.assertEqual(frame.min(), 0)
+        self.assertEqual(frame.max(), 255)
+
+    def test_serialize_resize(self):
+        frame = serialize_array(self.image, 256)
+        out = np.empty((1024, 1024), dtype=np.uint8)
+        self.assertIs(serialize_array(self.image, 1024, out=out), out)
+        self.assertTrue(np.array_equal(out[::4, ::4], frame))
+        odd = serialize_array(self.image, 300)
+        self.assertEqual(odd.shape, (300, 300))
+        self.assertEqual(odd[0, 0], frame[0, 0])
+        self.assertEqual(odd[-1, -1], frame[-1, -1])
+
+    def test_serialize_constant(self):
+        frame = serialize_array(np.ones((256, 256)))
+        self.assertFalse(frame.any())
+
+    def test_cmd(self):
+        cmd = make_cmd(512, 2, 25)
+        self.assertEqual(cmd[cmd.index('-s') + 1], '512x512')
+        self.assertEqual(cmd[cmd.index('-framerate') + 1], '2')
+
+    def test_sink_args(self):
+        url = 'rtmp://a.rtmp.youtube.com/live2/secret'
+        self.assertEqual(sink_args(url), ['-f', 'flv', url])
+        self.assertEqual(sink_args('tcp://127.0.0.1:5001'),
+                         ['-f', 'flv', 'tcp://127.0.0.1:5001'])
+        self.assertEqual(sink_args('null')[:2], ['-f', 'null'])
+        self.assertEqual(sink_args('out.mp4'), ['-y', 'out.mp4'])
+
+    def test_writer(self):
+        pipe = FakePipe()
+        writer = StreamWriter(pipe, size=512, input_rate=50)
+        writer.update(self.image)
+        writer.start()
+        time.sleep(0.2)
+        writer.stop()
+        writer.join()
+        data = pipe.stdin.getvalue()
+        self.assertEqual(len(data), writer.frames * 512 * 512)
+        self.assertGreater(writer.frames, 1)
+        self.assertEqual(writer.repeats, writer.frames - 1)
+        expected = serialize_array(self.image, 512).tobytes()
+        self.assertEqual(data[-512 * 512:], expected)
+
+
+class testImageLoop(unittest.TestCase):
+    def setUp(self):
+        from casacore.images import image
+        self.folder = tempfile.mkdtemp()
+        self.data = []
+        for i in range(3):
+            data = np.random.rand(1, 1, 16, 16).astype(np.float32)
+            im = image(os.path.join(self.folder, '{}.img'.format(i)),
+                       shape=data.shape)
+            im.putdata(data)
+            del im
+            self.data.append(data)
+
+    def test_loop(self):
+        loop = ImageLoop(self.folder, size=32, cache=3)
+        frames = list(itertools.islice(loop, 7))
+        loop.close()
+        for i, frame in enumerate(frames):
+            expected = serialize_array(self.data[i % 3], 32)
+            self.assertTrue(np.array_equal(frame, expected))
+        self.assertEqual(loop.reads, 3)
+
+    def test_small_cache(self):
+        loop = ImageLoop(self.folder, size=16, cache=2, prefetch=1)
+        frames = list(itertools.islice(loop, 6))
+        loop.close()
+        self.assertTrue(np.array_equal(frames[5],
+                                       serialize_array(self.data[2])))
+        self.assertGreater(loop.reads, 3)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+from arthur import constants
+from arthur import writer
+
+FRQ = 58398437.5  # Central observation frequency in Hz
+
+
+class testWriter(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # cleanups run last in first out, after the render pool shut down
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_atomic_write(self):
+        filename = os.path.join(self.folder, 'image.png')
+
+        def fail(tmp):
+            open(tmp, 'w').write('partial')
+            raise ValueError
+
+        self.assertRaises(ValueError, writer.atomic_write, filename, fail)
+        self.assertEqual(os.listdir(self.folder), [])
+        writer.atomic_write(filename, lambda tmp: open(tmp, 'w').write('done'))
+        self.assertEqual(os.listdir(self.folder), ['image.png'])
+
+    def test_link_latest(self):
+        writer.link_latest(self.folder, 'image', 'first.png')
+        writer.link_latest(self.folder, 'image', 'second.png')
+        link = os.path.join(self.folder, 'image.png')
+        self.assertEqual(os.readlink(link), 'second.png')
+        self.assertEqual(os.listdir(self.folder), ['image.png'])
+
+    def test_closure_pool(self):
+        closure = writer.make_imaging_closure(self.folder, FRQ, workers=2)
+        self.addCleanup(closure.shutdown)
+        date = datetime(2016, 6, 2, 21, 29, 58)
+        size = constants.IMAGE_RES
+        for i in range(2):
+            closure(date + timedelta(seconds=i), np.random.rand(size, size),
+                    np.random.rand(constants.NUM_ANTS, constants.NUM_ANTS),
+                    np.random.rand(constants.NUM_CHAN))
+        files = os.listdir(self.folder)
+        self.assertEqual(len(files), 15)
+        self.assertFalse([f for f in files if f.endswith('.tmp')])
+        latest = os.readlink(os.path.join(self.folder, 'diff.png'))
+        self.assertEqual(latest, writer.make_filename(date + timedelta(seconds=1),
+                                                      FRQ, 'diff'))